@@ -1,12 +1,16 @@
 from __future__ import annotations
 
+import asyncio
+import functools
 import logging
 import os
 import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from typing import Any, Dict, Iterable, Optional, Sequence, Tuple
 
 import psycopg2
+import psycopg2.extras
 import psycopg2.pool
 from psycopg2 import InterfaceError, OperationalError
 
@@ -17,16 +21,28 @@ logger = logging.getLogger(__name__)
 
 
 class Database:
-    """Lightweight PostgreSQL helper built on psycopg2's SimpleConnectionPool."""
+    """Lightweight PostgreSQL helper built on psycopg2's ThreadedConnectionPool."""
+
+    # Bot, webhook thanh toán và job nền dùng chung pool này. getconn() của psycopg2
+    # báo PoolError ngay khi hết connection, nên mọi lượt mượn đi qua _slots để chờ.
+    MIN_CONNECTIONS = int(os.getenv("DB_MIN_CONNECTIONS", "4"))
+    MAX_CONNECTIONS = int(os.getenv("DB_MAX_CONNECTIONS", "16"))
+    BORROW_TIMEOUT = float(os.getenv("DB_BORROW_TIMEOUT", "30"))
 
     def __init__(self) -> None:
         self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.MAX_CONNECTIONS)
         self._pool = self._create_pool()
+        # Async handlers run the blocking psycopg2 calls here. Other threads (payment
+        # webhook workers) borrow from the same pool; _slots makes them wait their turn.
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.MAX_CONNECTIONS, thread_name_prefix="db"
+        )
 
-    def _create_pool(self) -> psycopg2.pool.SimpleConnectionPool:
-        return psycopg2.pool.SimpleConnectionPool(
-            minconn=1,
-            maxconn=5,
+    def _create_pool(self) -> psycopg2.pool.ThreadedConnectionPool:
+        return psycopg2.pool.ThreadedConnectionPool(
+            minconn=self.MIN_CONNECTIONS,
+            maxconn=self.MAX_CONNECTIONS,
             host=os.getenv("DB_HOST"),
             port=os.getenv("DB_PORT"),
             dbname=os.getenv("DB_NAME"),
@@ -50,14 +66,21 @@ class Database:
             logger.info("Recreated PostgreSQL connection pool after failure.")
 
     def _borrow_connection(self):
-        conn = self._pool.getconn()
-        if conn and conn.closed:
-            # Drop closed/stale connection and borrow a fresh one.
-            try:
-                self._pool.putconn(conn, close=True)
-            except Exception:
-                pass
+        # Chờ tới khi có connection rảnh thay vì để getconn() báo PoolError.
+        if not self._slots.acquire(timeout=self.BORROW_TIMEOUT):
+            raise psycopg2.pool.PoolError("timed out waiting for a pooled connection")
+        try:
             conn = self._pool.getconn()
+            if conn and conn.closed:
+                # Drop closed/stale connection and borrow a fresh one.
+                try:
+                    self._pool.putconn(conn, close=True)
+                except Exception:
+                    pass
+                conn = self._pool.getconn()
+        except BaseException:
+            self._slots.release()
+            raise
         return conn
 
     def _safe_putconn(self, conn, close: bool = False) -> None:
@@ -65,6 +88,8 @@ class Database:
             self._pool.putconn(conn, close=close)
         except Exception:
             pass
+        finally:
+            self._slots.release()
 
     def _with_reconnect(self, query_fn):
         """
@@ -77,6 +102,7 @@ class Database:
         except (OperationalError, InterfaceError):
             if conn:
                 self._safe_putconn(conn, close=True)
+                conn = None
             self._reset_pool()
             conn = self._borrow_connection()
             return query_fn(conn)
@@ -112,21 +138,67 @@ class Database:
 
         return self._with_reconnect(_run)
 
+    def execute_returning(
+        self, query: str, params: Optional[Sequence[Any]] = None
+    ) -> Iterable[Tuple[Any, ...]]:
+        """Run a write with a RETURNING clause, commit, and return its rows."""
 
-db = Database()
+        def _run(conn):
+            with conn.cursor() as cur:
+                cur.execute(query, params)
+                rows = cur.fetchall()
+                conn.commit()
+                return rows
 
+        return self._with_reconnect(_run)
 
-def _split_transaction_content(content: str) -> Tuple[str, str]:
-    """
-    Split Sepay's `transaction_content` into (order_code, sender).
-    Falls back to a single token when we cannot reliably detect two parts.
-    """
-    parts = (content or "").strip().split()
-    if not parts:
-        raise ValueError("transaction_content is empty")
-    if len(parts) == 1:
-        return parts[0], parts[0]
-    return parts[-1], parts[0]
+    def execute_batch(
+        self, query: str, rows: Sequence[Sequence[Any]], page_size: int = 100
+    ) -> int:
+        """
+        Run the same single-row statement for many parameter sets, grouped into
+        pages to cut round-trips, inside one transaction. Returns the number of rows sent.
+        """
+        if not rows:
+            return 0
+
+        def _run(conn):
+            with conn.cursor() as cur:
+                psycopg2.extras.execute_batch(cur, query, rows, page_size=page_size)
+                conn.commit()
+
+        self._with_reconnect(_run)
+        return len(rows)
+
+    async def run_async(self, fn, *args):
+        """Run a blocking function that talks to the database on the DB executor."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(fn, *args))
+
+    async def execute_async(self, query: str, params: Optional[Sequence[Any]] = None) -> None:
+        """`execute` for async handlers: runs off the event loop."""
+        await self.run_async(self.execute, query, params)
+
+    async def fetch_one_async(
+        self, query: str, params: Optional[Sequence[Any]] = None
+    ) -> Optional[Tuple[Any, ...]]:
+        """`fetch_one` for async handlers: runs off the event loop."""
+        return await self.run_async(self.fetch_one, query, params)
+
+    async def fetch_all_async(
+        self, query: str, params: Optional[Sequence[Any]] = None
+    ) -> Iterable[Tuple[Any, ...]]:
+        """`fetch_all` for async handlers: runs off the event loop."""
+        return await self.run_async(self.fetch_all, query, params)
+
+    async def execute_returning_async(
+        self, query: str, params: Optional[Sequence[Any]] = None
+    ) -> Iterable[Tuple[Any, ...]]:
+        """`execute_returning` for async handlers: runs off the event loop."""
+        return await self.run_async(self.execute_returning, query, params)
+
+
+db = Database()
 
 
 def insert_payment_receipt(transaction_data: Dict[str, Any]) -> None:
@@ -99,6 +99,7 @@ class PaymentReceiptColumns:
     SO_TIEN: Final[str] = "so_tien"
     NGUOI_GUI: Final[str] = "nguoi_gui"
     NOI_DUNG_CK: Final[str] = "noi_dung_ck"
+    MA_GIAO_DICH: Final[str] = "ma_giao_dich"
 
 PAYMENT_SUPPLY_TABLE: Final[str] = f"{SCHEMA}.payment_supply"
 class PaymentSupplyColumns:
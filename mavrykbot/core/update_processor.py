@@ -0,0 +1,53 @@
+"""
+Update processor that runs different chats concurrently but keeps each chat in order.
+
+By default PTB handles updates one at a time, so a slow handler in one chat
+(an order search, a DB write) holds up every other chat. Plain
+`concurrent_updates=True` would fix that but lets two updates from the same
+chat race through a ConversationHandler. This processor serializes per chat
+and lets other chats proceed.
+"""
+from __future__ import annotations
+
+import asyncio
+from typing import Awaitable, Dict
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    def __init__(self, max_concurrent_updates: int = 32) -> None:
+        super().__init__(max_concurrent_updates)
+        self._locks: Dict[int, asyncio.Lock] = {}
+        self._waiters: Dict[int, int] = {}
+
+    async def process_update(self, update: object, coroutine: Awaitable) -> None:
+        chat = update.effective_chat if isinstance(update, Update) else None
+        if chat is None:
+            await super().process_update(update, coroutine)
+            return
+
+        key = chat.id
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+        try:
+            # Chờ lock của chat trước rồi mới lấy slot chung: update đang xếp hàng
+            # trong một chat không được giữ slot của các chat khác.
+            async with lock:
+                await super().process_update(update, coroutine)
+        finally:
+            # Bỏ lock khi chat không còn update nào đang chờ để dict không phình mãi.
+            self._waiters[key] -= 1
+            if not self._waiters[key]:
+                del self._waiters[key]
+                self._locks.pop(key, None)
+
+    async def do_process_update(self, update: object, coroutine: Awaitable) -> None:
+        await coroutine
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
@@ -10,12 +10,15 @@ logger_name = __name__
 
 VN_TZ = timezone(timedelta(hours=7))
 
+# Bảng escape MarkdownV2 dựng một lần; str.translate chỉ quét chuỗi một lượt.
+MDV2_ESCAPE_TABLE = str.maketrans({c: "\\" + c for c in r"_*[]()~`>#+-=|{}.!"})
+
 
 def escape_mdv2(text: str) -> str:
     """Escape MarkdownV2 meta characters."""
     if not isinstance(text, str):
         text = str(text)
-    return re.sub(r"([_\*\[\]\(\)~`>\#\+\-\=\|\{\}\.!])", r"\\\1", text)
+    return text.translate(MDV2_ESCAPE_TABLE)
 
 
 def compute_dates(so_ngay: int, start_date: datetime | None = None):
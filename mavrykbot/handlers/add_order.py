@@ -1,10 +1,11 @@
 import logging
 import re
 import asyncio
-import requests
 import string
-from datetime import datetime
+from dataclasses import dataclass, field
+from datetime import date, datetime
 from decimal import Decimal
+from urllib.parse import quote_plus
 from dateutil.relativedelta import relativedelta
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
@@ -38,6 +39,98 @@ logger = logging.getLogger(__name__)
     STATE_NHAP_GIA_BAN, STATE_NHAP_NOTE
 ) = range(15)
 
+# Pattern callback_data biên dịch một lần, dùng lại cho mọi ConversationHandler
+_PAT_LOAI_KHACH = re.compile(r"^(le|ctv|mavk)$")
+_PAT_CHON_PKG = re.compile(r"^chon_pkg\|")
+_PAT_CHON_PKG_PROD = re.compile(r"^chon_pkg_prod\|")
+_PAT_CHON_MA = re.compile(r"^chon_ma\|")
+_PAT_CHON_NGUON = re.compile(r"^chon_nguon\|")
+
+# =============================
+# Câu SQL cố định — dựng một lần khi import
+# =============================
+_Q_PRODUCT_SEARCH = f"""
+    SELECT 
+        {ProductPriceColumns.ID}, {ProductPriceColumns.SAN_PHAM}, 
+        {ProductPriceColumns.PACKAGE}, {ProductPriceColumns.PACKAGE_PRODUCT}
+    FROM {PRODUCT_PRICE_TABLE}
+    WHERE 
+        {ProductPriceColumns.SAN_PHAM} ILIKE %s 
+        AND LOWER(CAST({ProductPriceColumns.IS_ACTIVE} AS TEXT)) = 'true'
+    ORDER BY {ProductPriceColumns.PACKAGE}, {ProductPriceColumns.PACKAGE_PRODUCT}
+"""
+
+_Q_SOURCE_PRICES = f"""
+    SELECT 
+        T1.{SupplyColumns.SOURCE_NAME}, T2.{SupplyPriceColumns.PRICE}
+    FROM {SUPPLY_TABLE} AS T1
+    JOIN {SUPPLY_PRICE_TABLE} AS T2
+        ON T1.{SupplyColumns.ID} = T2.{SupplyPriceColumns.SOURCE_ID}
+    WHERE T2.{SupplyPriceColumns.PRODUCT_ID} = %s AND T2.{SupplyPriceColumns.PRICE} > 0
+    ORDER BY T1.{SupplyColumns.SOURCE_NAME}
+"""
+
+_Q_MAX_PRICE = f"""
+    SELECT MAX({SupplyPriceColumns.PRICE}) 
+    FROM {SUPPLY_PRICE_TABLE} 
+    WHERE {SupplyPriceColumns.PRODUCT_ID} = %s
+"""
+
+_Q_PCT = f"""
+    SELECT {ProductPriceColumns.PCT_CTV}, {ProductPriceColumns.PCT_KHACH} 
+    FROM {PRODUCT_PRICE_TABLE} 
+    WHERE {ProductPriceColumns.ID} = %s
+"""
+
+_Q_INSERT_ORDER = f"""
+    INSERT INTO {ORDER_LIST_TABLE} (
+        {OrderListColumns.ID_DON_HANG}, {OrderListColumns.SAN_PHAM},
+        {OrderListColumns.THONG_TIN_SAN_PHAM}, {OrderListColumns.KHACH_HANG},
+        {OrderListColumns.LINK_LIEN_HE}, {OrderListColumns.SLOT},
+        {OrderListColumns.NGAY_DANG_KI}, {OrderListColumns.SO_NGAY_DA_DANG_KI},
+        {OrderListColumns.HET_HAN}, {OrderListColumns.NGUON},
+        {OrderListColumns.GIA_NHAP}, {OrderListColumns.GIA_BAN},
+        {OrderListColumns.NOTE}, {OrderListColumns.TINH_TRANG},
+        {OrderListColumns.CHECK_FLAG}
+    ) VALUES (
+        %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s
+    )
+"""
+
+# =============================
+# Dữ liệu đơn đang nhập — lưu một object duy nhất trong user_data
+# =============================
+@dataclass(slots=True)
+class OrderDraft:
+    main_message_id: int | None = None
+    loai_khach: str = ""
+    ma_don: str = ""
+    ten_san_pham_raw: str = ""
+    matched_products: list = field(default_factory=list)
+    product_map: dict = field(default_factory=dict)
+    selected_package: str | None = None
+    selected_pkg_prod: str | None = None
+    ma_chon: str = ""
+    product_id: int | None = None
+    so_ngay: int = 0
+    source_price_map: dict = field(default_factory=dict)
+    nguon: str = ""
+    gia_nhap_value: int = 0
+    gia_ban_value: int = 0
+    thong_tin_don: str = ""
+    khach_hang: str = ""
+    link_khach: str = ""
+    slot: str = ""
+    note: str = ""
+
+
+def _draft(context: ContextTypes.DEFAULT_TYPE) -> OrderDraft:
+    draft = context.user_data.get("draft")
+    if draft is None:
+        draft = context.user_data["draft"] = OrderDraft()
+    return draft
+
+
 # =============================
 # Tiện ích chung + MarkdownV2-safe
 # =============================
@@ -127,7 +220,7 @@ async def start_add(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
     await query.answer()
     context.user_data.clear()
-    context.user_data['main_message_id'] = query.message.message_id
+    context.user_data["draft"] = OrderDraft(main_message_id=query.message.message_id)
 
     keyboard = [
         [
@@ -150,14 +243,15 @@ async def start_add(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
 
 
 async def chon_loai_khach_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    draft = _draft(context)
     query = update.callback_query
     await query.answer()
-    context.user_data["loai_khach"] = query.data
+    draft.loai_khach = query.data
     chat_id = query.message.chat.id
 
     try:
         ma_don = generate_unique_id(query.data) 
-        context.user_data["ma_don"] = ma_don
+        draft.ma_don = ma_don
     except Exception as e:
         logger.error(f"Lỗi tạo mã đơn: {e}")
         await safe_edit_md(context.bot, chat_id, query.message.message_id, md("❌ Lỗi tạo mã đơn."))
@@ -176,10 +270,11 @@ async def chon_loai_khach_handler(update: Update, context: ContextTypes.DEFAULT_
 # 2) Nhập tên sản phẩm — ĐÃ CHUYỂN SANG SQL
 # =============================
 async def nhap_ten_sp_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    draft = _draft(context)
     ten_sp = update.message.text.strip()
     await update.message.delete()
-    context.user_data['ten_san_pham_raw'] = ten_sp
-    main_message_id = context.user_data.get('main_message_id')
+    draft.ten_san_pham_raw = ten_sp
+    main_message_id = draft.main_message_id
     chat_id = update.effective_chat.id
 
     await safe_edit_md(
@@ -188,18 +283,8 @@ async def nhap_ten_sp_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
     )
 
     try:
-        sql_query = f"""
-            SELECT 
-                {ProductPriceColumns.ID}, {ProductPriceColumns.SAN_PHAM}, 
-                {ProductPriceColumns.PACKAGE}, {ProductPriceColumns.PACKAGE_PRODUCT}
-            FROM {PRODUCT_PRICE_TABLE}
-            WHERE 
-                {ProductPriceColumns.SAN_PHAM} ILIKE %s 
-                AND LOWER(CAST({ProductPriceColumns.IS_ACTIVE} AS TEXT)) = 'true'
-            ORDER BY {ProductPriceColumns.PACKAGE}, {ProductPriceColumns.PACKAGE_PRODUCT}
-        """
         search_term = f'%{ten_sp}%'
-        matched_products = db.fetch_all(sql_query, (search_term,))
+        matched_products = db.fetch_all(_Q_PRODUCT_SEARCH, (search_term,))
     except Exception as e:
         logger.error(f"Lỗi khi truy vấn PRODUCT_PRICE: {e}")
         await safe_edit_md(context.bot, chat_id, main_message_id, md("❌ Lỗi kết nối CSDL."))
@@ -214,19 +299,19 @@ async def nhap_ten_sp_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
         # Chuyển thẳng sang nhập mã mới vì không tìm thấy gì
         return STATE_NHAP_MA_MOI
 
-    context.user_data["matched_products"] = matched_products
+    draft.matched_products = matched_products
     packages = sorted(list(set(row[2] for row in matched_products if row[2])))
 
     if not packages:
         # Nếu không có package, chuyển thẳng sang chọn mã sản phẩm (san_pham) nếu có
         product_map = {row[1]: row[0] for row in matched_products}
-        context.user_data["product_map"] = product_map
+        draft.product_map = product_map
         return await _display_final_products(chat_id, main_message_id, context, list(product_map.keys()))
 
     # If there's only one package, auto-select it and proceed to package_product selection
     if len(packages) == 1:
         selected_package = packages[0]
-        context.user_data['selected_package'] = selected_package
+        draft.selected_package = selected_package
         return await _display_package_products(chat_id, main_message_id, context, selected_package)
 
     keyboard, row = [], []
@@ -249,7 +334,8 @@ async def nhap_ten_sp_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
 
 async def _display_package_products(chat_id: int, message_id: int, context: ContextTypes.DEFAULT_TYPE, selected_package: str) -> int:
     """Helper to display package product selection."""
-    matched_products = context.user_data.get("matched_products", [])
+    draft = _draft(context)
+    matched_products = draft.matched_products
     
     package_products = sorted(list(set(
         row[3] for row in matched_products if row[2] == selected_package and row[3]
@@ -259,7 +345,7 @@ async def _display_package_products(chat_id: int, message_id: int, context: Cont
         # Nếu không có package_product, chuyển thẳng sang chọn mã sản phẩm (san_pham)
         final_products = [row for row in matched_products if row[2] == selected_package]
         product_map = {row[1]: row[0] for row in final_products}
-        context.user_data["product_map"] = product_map
+        draft.product_map = product_map
         return await _display_final_products(chat_id, message_id, context, list(product_map.keys()))
 
     keyboard, row = [], []
@@ -304,23 +390,25 @@ async def _display_final_products(chat_id: int, message_id: int, context: Contex
 
 
 async def chon_package_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    draft = _draft(context)
     query = update.callback_query
     await query.answer()
     selected_package = query.data.split("|", 1)[1]
-    context.user_data['selected_package'] = selected_package
+    draft.selected_package = selected_package
     
-    main_message_id = context.user_data.get('main_message_id')
+    main_message_id = draft.main_message_id
     return await _display_package_products(query.message.chat.id, main_message_id, context, selected_package)
 
 
 async def chon_package_product_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    draft = _draft(context)
     query = update.callback_query
     await query.answer()
     selected_pkg_prod = query.data.split("|", 1)[1]
-    context.user_data['selected_pkg_prod'] = selected_pkg_prod
+    draft.selected_pkg_prod = selected_pkg_prod
 
-    matched_products = context.user_data.get("matched_products", [])
-    selected_package = context.user_data.get("selected_package")
+    matched_products = draft.matched_products
+    selected_package = draft.selected_package
 
     # Filter by both package and package_product to get final product list
     final_products = [
@@ -338,7 +426,7 @@ async def chon_package_product_handler(update: Update, context: ContextTypes.DEF
 
     # product_map: {san_pham_name: product_id}
     product_map = {row[1]: row[0] for row in final_products}
-    context.user_data["product_map"] = product_map
+    draft.product_map = product_map
     
     product_keys = list(product_map.keys())
 
@@ -359,18 +447,19 @@ async def nhap_ma_moi_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
 
 # Nếu không có mã hợp lệ trong CSDL, sau khi nhập mã mới -> đi thẳng sang nhập Nguồn mới
 async def xu_ly_ma_moi_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    draft = _draft(context)
     ma_moi = update.message.text.strip().replace("—", "--").replace("–", "--")
     await update.message.delete()
-    context.user_data['ma_chon'] = ma_moi
+    draft.ma_chon = ma_moi
     so_ngay = extract_days_from_ma_sp(ma_moi)
     if so_ngay > 0:
-        context.user_data['so_ngay'] = str(so_ngay)
+        draft.so_ngay = so_ngay
 
     chat_id = update.effective_chat.id
     
     # Chuyển thẳng sang nhập Tên Nguồn mới (vì không tra cứu/chọn nguồn)
     await safe_edit_md(
-        context.bot, chat_id, context.user_data['main_message_id'],
+        context.bot, chat_id, draft.main_message_id,
         text="🚚 Vui lòng nhập *tên Nguồn hàng*\\:",
         reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("❌ Hủy", callback_data="cancel_add")]])
     )
@@ -381,36 +470,28 @@ async def xu_ly_ma_moi_handler(update: Update, context: ContextTypes.DEFAULT_TYP
 # 3) Chọn mã -> liệt kê nguồn từ Supply_Price (ĐÃ CHUYỂN SANG SQL)
 # =============================
 async def chon_ma_sp_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    draft = _draft(context)
     query = update.callback_query
     await query.answer()
     ma_chon = query.data.split("|", 1)[1]
-    context.user_data['ma_chon'] = ma_chon
+    draft.ma_chon = ma_chon
 
-    product_map = context.user_data.get("product_map", {})
+    product_map = draft.product_map
     product_id = product_map.get(ma_chon)
 
     if not product_id:
         await safe_edit_md(context.bot, query.message.chat.id, query.message.message_id, md("❌ Lỗi: Không tìm thấy ID sản phẩm."))
         return await end_add(update, context, success=False)
 
-    context.user_data['product_id'] = product_id
+    draft.product_id = product_id
 
     so_ngay = extract_days_from_ma_sp(ma_chon)
     if so_ngay > 0:
-        context.user_data['so_ngay'] = str(so_ngay)
+        draft.so_ngay = so_ngay
 
     try:
         # Truy vấn SQL JOIN 3 bảng để tìm nguồn hàng (SupplyName) và giá (Price)
-        sql_query = f"""
-            SELECT 
-                T1.{SupplyColumns.SOURCE_NAME}, T2.{SupplyPriceColumns.PRICE}
-            FROM {SUPPLY_TABLE} AS T1
-            JOIN {SUPPLY_PRICE_TABLE} AS T2
-                ON T1.{SupplyColumns.ID} = T2.{SupplyPriceColumns.SOURCE_ID}
-            WHERE T2.{SupplyPriceColumns.PRODUCT_ID} = %s AND T2.{SupplyPriceColumns.PRICE} > 0
-            ORDER BY T1.{SupplyColumns.SOURCE_NAME}
-        """
-        source_prices = db.fetch_all(sql_query, (product_id,)) 
+        source_prices = db.fetch_all(_Q_SOURCE_PRICES, (product_id,))
     except Exception as e:
         logger.error(f"Lỗi khi truy vấn Supply Price: {e}")
         await safe_edit_md(context.bot, query.message.chat.id, query.message.message_id, md("❌ Lỗi kết nối CSDL khi tìm nguồn hàng."))
@@ -430,7 +511,7 @@ async def chon_ma_sp_handler(update: Update, context: ContextTypes.DEFAULT_TYPE)
     if row:
         keyboard.append(row)
         
-    context.user_data['source_price_map'] = source_price_map
+    draft.source_price_map = source_price_map
 
     keyboard.append([InlineKeyboardButton("➕ Nguồn Mới", callback_data="nguon_moi"), InlineKeyboardButton("❌ Hủy", callback_data="cancel_add")])
     await safe_edit_md(
@@ -445,6 +526,7 @@ async def chon_ma_sp_handler(update: Update, context: ContextTypes.DEFAULT_TYPE)
 # 4) Chọn nguồn -> lấy Giá nhập, Giá bán (ĐÃ CHUYỂN SANG SQL)
 # =============================
 async def chon_nguon_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    draft = _draft(context)
     query = update.callback_query
     await query.answer()
 
@@ -455,15 +537,15 @@ async def chon_nguon_handler(update: Update, context: ContextTypes.DEFAULT_TYPE)
         return await end_add(update, context, success=False)
 
     nguon = parts[1].strip()
-    context.user_data["nguon"] = nguon
+    draft.nguon = nguon
 
-    product_id = context.user_data.get('product_id')
-    source_price_map = context.user_data.get('source_price_map', {})
-    ma_don = context.user_data.get("ma_don", "")
+    product_id = draft.product_id
+    source_price_map = draft.source_price_map
+    ma_don = draft.ma_don
 
     # 1. Lấy Giá nhập 
     gia_nhap = source_price_map.get(nguon, 0)
-    context.user_data["gia_nhap_value"] = gia_nhap
+    draft.gia_nhap_value = gia_nhap
     logger.info(f"LOG_PRICE_CALC | Initial input price (gia_nhap) for source '{nguon}': {gia_nhap}")
     
     # Mặc định giá bán bằng giá nhập, sử dụng Decimal
@@ -471,24 +553,14 @@ async def chon_nguon_handler(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
     try:
         # 2. Lấy giá cao nhất từ nhà cung cấp cho sản phẩm này
-        highest_price_query = f"""
-            SELECT MAX({SupplyPriceColumns.PRICE}) 
-            FROM {SUPPLY_PRICE_TABLE} 
-            WHERE {SupplyPriceColumns.PRODUCT_ID} = %s
-        """
-        highest_price_result = db.fetch_one(highest_price_query, (product_id,))
+        highest_price_result = db.fetch_one(_Q_MAX_PRICE, (product_id,))
         highest_price = highest_price_result[0] if highest_price_result and highest_price_result[0] is not None else Decimal(0)
         logger.info(f"LOG_PRICE_CALC | Highest Price for product_id {product_id}: {highest_price}")
 
 
         if highest_price > 0:
             # 3. Lấy các hệ số nhân giá từ bảng Product_Price
-            percentages_query = f"""
-                SELECT {ProductPriceColumns.PCT_CTV}, {ProductPriceColumns.PCT_KHACH} 
-                FROM {PRODUCT_PRICE_TABLE} 
-                WHERE {ProductPriceColumns.ID} = %s
-            """
-            percentages_result = db.fetch_one(percentages_query, (product_id,))
+            percentages_result = db.fetch_one(_Q_PCT, (product_id,))
             
             if percentages_result:
                 pct_ctv, pct_khach = percentages_result
@@ -527,7 +599,7 @@ async def chon_nguon_handler(update: Update, context: ContextTypes.DEFAULT_TYPE)
         gia_ban_rounded,
     )
 
-    context.user_data["gia_ban_value"] = gia_ban_rounded
+    draft.gia_ban_value = gia_ban_rounded
     logger.info(f"LOG_PRICE_CALC | Final calculated price (integer): {gia_ban_rounded}")
 
     await safe_edit_md(
@@ -553,10 +625,11 @@ async def chon_nguon_moi_handler(update: Update, context: ContextTypes.DEFAULT_T
 
 
 async def nhap_nguon_moi_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    context.user_data["nguon"] = update.message.text.strip()
+    draft = _draft(context)
+    draft.nguon = update.message.text.strip()
     await update.message.delete()
     await safe_edit_md(
-        context.bot, update.effective_chat.id, context.user_data['main_message_id'],
+        context.bot, update.effective_chat.id, draft.main_message_id,
         text="💰 Vui lòng nhập *Giá nhập*:",
         reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("❌ Hủy", callback_data="cancel_add")]])
     )
@@ -564,6 +637,7 @@ async def nhap_nguon_moi_handler(update: Update, context: ContextTypes.DEFAULT_T
 
 
 async def nhap_gia_nhap_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    draft = _draft(context)
     gia_nhap_raw = update.message.text.strip()
     await update.message.delete()
     
@@ -571,26 +645,27 @@ async def nhap_gia_nhap_handler(update: Update, context: ContextTypes.DEFAULT_TY
 
     if gia_nhap_value < 0:
         await safe_edit_md(
-            context.bot, update.effective_chat.id, context.user_data['main_message_id'],
+            context.bot, update.effective_chat.id, draft.main_message_id,
             text="⚠️ Giá nhập không hợp lệ. Vui lòng chỉ nhập số:",
             reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("❌ Hủy", callback_data="cancel_add")]])
         )
         return STATE_NHAP_GIA_NHAP
 
-    context.user_data["gia_nhap_value"] = gia_nhap_value
+    draft.gia_nhap_value = gia_nhap_value
 
     await safe_edit_md(
-        context.bot, update.effective_chat.id, context.user_data['main_message_id'],
+        context.bot, update.effective_chat.id, draft.main_message_id,
         text="📝 Vui lòng nhập *Thông tin đơn hàng*:",
         reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("❌ Hủy", callback_data="cancel_add")]])
     )
     return STATE_NHAP_THONG_TIN
 
 async def nhap_thong_tin_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    context.user_data["thong_tin_don"] = update.message.text.strip()
+    draft = _draft(context)
+    draft.thong_tin_don = update.message.text.strip()
     await update.message.delete()
     await safe_edit_md(
-        context.bot, update.effective_chat.id, context.user_data['main_message_id'],
+        context.bot, update.effective_chat.id, draft.main_message_id,
         text="👤 Vui lòng nhập *tên khách hàng*:",
         reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("❌ Hủy", callback_data="cancel_add")]])
     )
@@ -598,11 +673,12 @@ async def nhap_thong_tin_handler(update: Update, context: ContextTypes.DEFAULT_T
 
 
 async def nhap_ten_khach_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    context.user_data["khach_hang"] = update.message.text.strip()
+    draft = _draft(context)
+    draft.khach_hang = update.message.text.strip()
     await update.message.delete()
     keyboard = [[InlineKeyboardButton("⏭️ Bỏ Qua", callback_data="skip_link")], [InlineKeyboardButton("❌ Hủy", callback_data="cancel_add")]]
     await safe_edit_md(
-        context.bot, update.effective_chat.id, context.user_data['main_message_id'],
+        context.bot, update.effective_chat.id, draft.main_message_id,
         text="🔗 Vui lòng nhập *thông tin liên hệ* hoặc bấm Bỏ Qua:",
         reply_markup=InlineKeyboardMarkup(keyboard)
     )
@@ -610,17 +686,18 @@ async def nhap_ten_khach_handler(update: Update, context: ContextTypes.DEFAULT_T
 
 
 async def nhap_link_khach_handler(update: Update, context: ContextTypes.DEFAULT_TYPE, skip: bool = False) -> int:
+    draft = _draft(context)
     query = update.callback_query
     if skip:
-        context.user_data["link_khach"] = ""
+        draft.link_khach = ""
         await query.answer()
         chat_id = query.message.chat.id
         mid = query.message.message_id
     else:
-        context.user_data["link_khach"] = update.message.text.strip()
+        draft.link_khach = update.message.text.strip()
         await update.message.delete()
         chat_id = update.effective_chat.id
-        mid = context.user_data['main_message_id']
+        mid = draft.main_message_id
     keyboard = [[InlineKeyboardButton("⏭️ Bỏ Qua", callback_data="skip_slot")], [InlineKeyboardButton("❌ Hủy", callback_data="cancel_add")]]
     await safe_edit_md(
         context.bot, chat_id, mid,
@@ -630,19 +707,20 @@ async def nhap_link_khach_handler(update: Update, context: ContextTypes.DEFAULT_
 
 
 async def nhap_slot_handler(update: Update, context: ContextTypes.DEFAULT_TYPE, skip: bool = False) -> int:
+    draft = _draft(context)
     query = update.callback_query
     if skip:
-        context.user_data["slot"] = ""
+        draft.slot = ""
         await query.answer()
         chat_id = query.message.chat.id
         mid = query.message.message_id
     else:
-        context.user_data["slot"] = update.message.text.strip()
+        draft.slot = update.message.text.strip()
         await update.message.delete()
         chat_id = update.effective_chat.id
-        mid = context.user_data['main_message_id']
+        mid = draft.main_message_id
 
-    if "gia_ban_value" in context.user_data and context.user_data["gia_ban_value"] > 0:
+    if draft.gia_ban_value > 0:
         keyboard = [[InlineKeyboardButton("⏭️ Bỏ Qua", callback_data="skip_note")], [InlineKeyboardButton("❌ Hủy", callback_data="cancel_add")]]
         await safe_edit_md(
             context.bot, chat_id, mid,
@@ -658,6 +736,7 @@ async def nhap_slot_handler(update: Update, context: ContextTypes.DEFAULT_TYPE,
 
 
 async def nhap_gia_ban_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    draft = _draft(context)
     gia_ban_raw = update.message.text.strip()
     await update.message.delete()
     
@@ -665,7 +744,7 @@ async def nhap_gia_ban_handler(update: Update, context: ContextTypes.DEFAULT_TYP
 
     if gia_ban_value < 0:
         await safe_edit_md(
-            context.bot, update.effective_chat.id, context.user_data['main_message_id'],
+            context.bot, update.effective_chat.id, draft.main_message_id,
             text="⚠️ Giá bán không hợp lệ. Vui lòng chỉ nhập số:",
             reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("❌ Hủy", callback_data="cancel_add")]])
         )
@@ -674,34 +753,36 @@ async def nhap_gia_ban_handler(update: Update, context: ContextTypes.DEFAULT_TYP
     gia_ban_rounded = _round_thousand(gia_ban_value)
     logger.info(f"LOG_PRICE_CALC | Manual price entered: {gia_ban_value}, Rounded to nearest thousand: {gia_ban_rounded}")
 
-    context.user_data["gia_ban_value"] = gia_ban_rounded
+    draft.gia_ban_value = gia_ban_rounded
 
     keyboard = [
         [InlineKeyboardButton("⏭️ Bỏ Qua", callback_data="skip_note")],
         [InlineKeyboardButton("❌ Hủy", callback_data="cancel_add")]
     ]
     await safe_edit_md(
-        context.bot, update.effective_chat.id, context.user_data['main_message_id'],
+        context.bot, update.effective_chat.id, draft.main_message_id,
         text="📝 Vui lòng nhập *Ghi chú* \\(nếu có\\) hoặc bấm Bỏ Qua:",
         reply_markup=InlineKeyboardMarkup(keyboard)
     )
     return STATE_NHAP_NOTE
 
 async def nhap_note_handler(update: Update, context: ContextTypes.DEFAULT_TYPE, skip: bool = False) -> int:
+    draft = _draft(context)
     query = update.callback_query
     if skip:
-        context.user_data["note"] = ""
+        draft.note = ""
         await query.answer()
     else:
-        context.user_data["note"] = update.message.text.strip()
+        draft.note = update.message.text.strip()
         await update.message.delete()
     return await hoan_tat_don(update, context)
 
 
 async def hoan_tat_don(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    draft = _draft(context)
     query = update.callback_query
     chat_id = query.message.chat.id if query else update.effective_chat.id
-    main_message_id = context.user_data.get('main_message_id')
+    main_message_id = draft.main_message_id
 
     if main_message_id:
         await safe_edit_md(
@@ -710,54 +791,37 @@ async def hoan_tat_don(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
         )
 
     try:
-        info = context.user_data
-        
         # --- Chuẩn bị dữ liệu cho SQL ---
-        ngay_bat_dau_dt = datetime.now().date()
+        ngay_bat_dau_dt = date.today()
         ngay_bat_dau_str = ngay_bat_dau_dt.strftime("%d/%m/%Y")
         
-        so_ngay = int(info.get("so_ngay", "0"))
-        gia_ban_value = info.get("gia_ban_value", 0)
+        so_ngay = draft.so_ngay
+        gia_ban_value = draft.gia_ban_value
         
         ngay_het_han_dt = tinh_ngay_het_han(ngay_bat_dau_str, so_ngay)
         
 
         # Ghi vao PostgreSQL
         try:
-            sql_query = f"""
-                INSERT INTO {ORDER_LIST_TABLE} (
-                    {OrderListColumns.ID_DON_HANG}, {OrderListColumns.SAN_PHAM},
-                    {OrderListColumns.THONG_TIN_SAN_PHAM}, {OrderListColumns.KHACH_HANG},
-                    {OrderListColumns.LINK_LIEN_HE}, {OrderListColumns.SLOT},
-                    {OrderListColumns.NGAY_DANG_KI}, {OrderListColumns.SO_NGAY_DA_DANG_KI},
-                    {OrderListColumns.HET_HAN}, {OrderListColumns.NGUON},
-                    {OrderListColumns.GIA_NHAP}, {OrderListColumns.GIA_BAN},
-                    {OrderListColumns.NOTE}, {OrderListColumns.TINH_TRANG},
-                    {OrderListColumns.CHECK_FLAG}
-                ) VALUES (
-                    %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s
-                )
-            """
-
             params = (
-                info.get("ma_don", ""),
-                info.get("ma_chon", info.get("ten_san_pham_raw", "")),
-                info.get("thong_tin_don", ""),
-                info.get("khach_hang", ""),
-                info.get("link_khach", ""),
-                info.get("slot", ""),
+                draft.ma_don,
+                draft.ma_chon or draft.ten_san_pham_raw,
+                draft.thong_tin_don,
+                draft.khach_hang,
+                draft.link_khach,
+                draft.slot,
                 ngay_bat_dau_dt,
                 so_ngay,
                 ngay_het_han_dt,
-                info.get("nguon", ""),
-                info.get("gia_nhap_value", 0),
+                draft.nguon,
+                draft.gia_nhap_value,
                 gia_ban_value,
-                info.get("note", ""),
+                draft.note,
                 "Chưa Thanh Toán",
                 None,
             )
 
-            db.execute(sql_query, params)
+            db.execute(_Q_INSERT_ORDER, params)
             logger.info("Inserted order %s into order_list", params[0])
 
         except Exception as e:
@@ -770,19 +834,19 @@ async def hoan_tat_don(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
             )
             return await end_add(update, context, success=False)
 
-        ma_don_final = info.get('ma_don','')
+        ma_don_final = draft.ma_don
         caption = (
             f"✅ Đơn hàng `{escape_mdv2(ma_don_final)}` đã được tạo thành công\\!\n\n"
             f"📦 *THÔNG TIN SẢN PHẨM*\n"
-            f"🔹 *Tên Sản Phẩm:* {escape_mdv2(info.get('ma_chon', ''))}\n"
-            f"📝 *Thông Tin Đơn Hàng:* `{escape_mdv2(info.get('thong_tin_don', ''))}`\n"
+            f"🔹 *Tên Sản Phẩm:* {escape_mdv2(draft.ma_chon)}\n"
+            f"📝 *Thông Tin Đơn Hàng:* `{escape_mdv2(draft.thong_tin_don)}`\n"
             f"📆 *Ngày Bắt đầu:* {escape_mdv2(ngay_bat_dau_str)}\n"
             f"⏳ *Thời hạn:* {escape_mdv2(str(so_ngay))} ngày\n"
             f"📅 *Ngày Hết hạn:* {escape_mdv2(ngay_het_han_dt.strftime('%d/%m/%Y') if ngay_het_han_dt else 'N/A')}\n"
             f"💵 *Giá bán:* {escape_mdv2(f'{gia_ban_value:,} đ'.replace(',', '.'))}\n\n" 
             f" *━━━━━━ 👤 ━━━━━━*\n"
             f"👤 *THÔNG TIN KHÁCH HÀNG*\n"
-            f"🔸 *Tên Khách Hàng:* {escape_mdv2(info.get('khach_hang', ''))}\n\n"
+            f"🔸 *Tên Khách Hàng:* {escape_mdv2(draft.khach_hang)}\n\n"
             f" *━━━━━━ 💳 ━━━━━━*\n"
             f"📢 *HƯỚNG DẪN THANH TOÁN*\n"
             f"📢 *STK:* 9183400998\n"
@@ -791,18 +855,20 @@ async def hoan_tat_don(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
 
         qr_url = (
             "https://img.vietqr.io/image/VPB-9183400998-compact2.png"
-            f"?amount={gia_ban_value}&addInfo={requests.utils.quote(ma_don_final)}"
+            f"?amount={gia_ban_value}&addInfo={quote_plus(ma_don_final)}"
             "&accountName=NGO LE NGOC HUNG"
         )
 
-        try:
-            await context.bot.delete_message(chat_id=chat_id, message_id=main_message_id)
-        except Exception:
-            pass
-        try:
-            await context.bot.send_photo(chat_id=chat_id, photo=qr_url, caption=caption, parse_mode="MarkdownV2")
-        except BadRequest:
+        # Xóa tin nhắn chính và gửi ảnh QR song song để bớt một lượt gọi API
+        _, photo_result = await asyncio.gather(
+            context.bot.delete_message(chat_id=chat_id, message_id=main_message_id),
+            context.bot.send_photo(chat_id=chat_id, photo=qr_url, caption=caption, parse_mode="MarkdownV2"),
+            return_exceptions=True,
+        )
+        if isinstance(photo_result, BadRequest):
             await context.bot.send_photo(chat_id=chat_id, photo=qr_url, caption=caption)
+        elif isinstance(photo_result, Exception):
+            raise photo_result
 
         await show_main_selector(update, context, edit=False)
 
@@ -832,26 +898,38 @@ async def cancel_add(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     return await end_add(update, context, success=False)
 
 
+async def _skip_link(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    return await nhap_link_khach_handler(update, context, skip=True)
+
+
+async def _skip_slot(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    return await nhap_slot_handler(update, context, skip=True)
+
+
+async def _skip_note(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    return await nhap_note_handler(update, context, skip=True)
+
+
 def get_add_order_conversation_handler():
     cancel_handler = CallbackQueryHandler(cancel_add, pattern="^cancel_add$")
     return ConversationHandler(
         entry_points=[CallbackQueryHandler(start_add, pattern="^add$")],
         states={
-            STATE_CHON_LOAI_KHACH: [cancel_handler, CallbackQueryHandler(chon_loai_khach_handler, pattern=r"^(le|ctv|mavk)$")],
+            STATE_CHON_LOAI_KHACH: [cancel_handler, CallbackQueryHandler(chon_loai_khach_handler, pattern=_PAT_LOAI_KHACH)],
             STATE_NHAP_TEN_SP: [cancel_handler, MessageHandler(filters.TEXT & ~filters.COMMAND, nhap_ten_sp_handler)],
-            STATE_CHON_PACKAGE: [cancel_handler, CallbackQueryHandler(chon_package_handler, pattern=r"^chon_pkg\|")],
-            STATE_CHON_PACKAGE_PRODUCT: [cancel_handler, CallbackQueryHandler(chon_package_product_handler, pattern=r"^chon_pkg_prod\|")],
-            STATE_CHON_MA_SP: [cancel_handler, CallbackQueryHandler(chon_ma_sp_handler, pattern=r"^chon_ma\|"), CallbackQueryHandler(nhap_ma_moi_handler, pattern="^nhap_ma_moi$")],
-            STATE_CHON_NGUON: [cancel_handler, CallbackQueryHandler(chon_nguon_handler, pattern=r"^chon_nguon\|"), CallbackQueryHandler(chon_nguon_moi_handler, pattern="^nguon_moi$")],
+            STATE_CHON_PACKAGE: [cancel_handler, CallbackQueryHandler(chon_package_handler, pattern=_PAT_CHON_PKG)],
+            STATE_CHON_PACKAGE_PRODUCT: [cancel_handler, CallbackQueryHandler(chon_package_product_handler, pattern=_PAT_CHON_PKG_PROD)],
+            STATE_CHON_MA_SP: [cancel_handler, CallbackQueryHandler(chon_ma_sp_handler, pattern=_PAT_CHON_MA), CallbackQueryHandler(nhap_ma_moi_handler, pattern="^nhap_ma_moi$")],
+            STATE_CHON_NGUON: [cancel_handler, CallbackQueryHandler(chon_nguon_handler, pattern=_PAT_CHON_NGUON), CallbackQueryHandler(chon_nguon_moi_handler, pattern="^nguon_moi$")],
             STATE_NHAP_MA_MOI: [cancel_handler, MessageHandler(filters.TEXT & ~filters.COMMAND, xu_ly_ma_moi_handler)],
             STATE_NHAP_NGUON_MOI: [cancel_handler, MessageHandler(filters.TEXT & ~filters.COMMAND, nhap_nguon_moi_handler)],
             STATE_NHAP_GIA_NHAP: [cancel_handler, MessageHandler(filters.TEXT & ~filters.COMMAND, nhap_gia_nhap_handler)],
             STATE_NHAP_THONG_TIN: [cancel_handler, MessageHandler(filters.TEXT & ~filters.COMMAND, nhap_thong_tin_handler)],
             STATE_NHAP_TEN_KHACH: [cancel_handler, MessageHandler(filters.TEXT & ~filters.COMMAND, nhap_ten_khach_handler)],
-            STATE_NHAP_LINK_KHACH: [cancel_handler, CallbackQueryHandler(lambda u, c: nhap_link_khach_handler(u, c, skip=True), pattern="^skip_link$"), MessageHandler(filters.TEXT & ~filters.COMMAND, nhap_link_khach_handler)],
-            STATE_NHAP_SLOT: [cancel_handler, CallbackQueryHandler(lambda u, c: nhap_slot_handler(u, c, skip=True), pattern="^skip_slot$"), MessageHandler(filters.TEXT & ~filters.COMMAND, nhap_slot_handler)],
+            STATE_NHAP_LINK_KHACH: [cancel_handler, CallbackQueryHandler(_skip_link, pattern="^skip_link$"), MessageHandler(filters.TEXT & ~filters.COMMAND, nhap_link_khach_handler)],
+            STATE_NHAP_SLOT: [cancel_handler, CallbackQueryHandler(_skip_slot, pattern="^skip_slot$"), MessageHandler(filters.TEXT & ~filters.COMMAND, nhap_slot_handler)],
             STATE_NHAP_GIA_BAN: [cancel_handler, MessageHandler(filters.TEXT & ~filters.COMMAND, nhap_gia_ban_handler)],
-            STATE_NHAP_NOTE: [cancel_handler, CallbackQueryHandler(lambda u, c: nhap_note_handler(u, c, skip=True), pattern="^skip_note$"), MessageHandler(filters.TEXT & ~filters.COMMAND, nhap_note_handler)],
+            STATE_NHAP_NOTE: [cancel_handler, CallbackQueryHandler(_skip_note, pattern="^skip_note$"), MessageHandler(filters.TEXT & ~filters.COMMAND, nhap_note_handler)],
         },
         fallbacks=[cancel_handler],
         name="add_order_conversation",
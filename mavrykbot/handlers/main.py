@@ -33,25 +33,10 @@ from telegram.ext import (
 )
 
 from mavrykbot.core.config import load_bot_config
-from mavrykbot.handlers.Payment_Supply import get_payment_supply_conversation_handler
-from mavrykbot.handlers.View_order_unpaid import get_unpaid_order_conversation_handler
-from mavrykbot.handlers.add_order import get_add_order_conversation_handler
+from mavrykbot.core.update_processor import PerChatUpdateProcessor
 from mavrykbot.handlers.menu import show_main_selector, show_outer_menu
-from mavrykbot.handlers.update_order import get_update_order_conversation_handler
-from mavrykbot.handlers.view_due_orders import check_due_orders_job, test_due_orders_command
 from mavrykbot.notifications.error_notifier import notify_error
 
-try:
-    from mavrykbot.handlers.create_qrcode import qr_conversation
-except ImportError:  # pragma: no cover - optional feature
-    qr_conversation = CommandHandler(
-        "qr_placeholder",
-        lambda update, context: context.bot.send_message(
-            update.effective_chat.id,
-            "QR feature is not available yet.",
-        ),
-    )
-
 logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
     level=logging.INFO,
@@ -62,6 +47,9 @@ BOT_TOKEN = load_bot_config().token
 
 _admin_chat_id = os.getenv("ADMIN_CHAT_ID")
 AUTHORIZED_USER_ID: Optional[int] = int(_admin_chat_id) if _admin_chat_id else None
+_ALLOWED_USER_IDS: frozenset[int] = (
+    frozenset({AUTHORIZED_USER_ID}) if AUTHORIZED_USER_ID is not None else frozenset()
+)
 DEFAULT_COMING_SOON = "Feature is under development."
 COMING_SOON_MESSAGES = {
     "start_refund": "Refund flow is under development.",
@@ -73,9 +61,12 @@ def user_only_filter(
     func: Callable[[Update, ContextTypes.DEFAULT_TYPE], Awaitable[None]]
 ):
     """Decorator restricting bot access to the configured admin."""
+    if not _ALLOWED_USER_IDS:
+        # Không cấu hình ADMIN_CHAT_ID: không cần lớp bọc async nào.
+        return func
 
     async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
-        if AUTHORIZED_USER_ID is not None and update.effective_user.id != AUTHORIZED_USER_ID:
+        if update.effective_user.id not in _ALLOWED_USER_IDS:
             logger.info(
                 "Access denied for user %s (%s)",
                 update.effective_user.id,
@@ -108,28 +99,43 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("Please use /menu to interact with the bot.")
 
 
+async def _noop(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Callback được ConversationHandler khác xử lý; chỉ cần chặn fallback."""
+    return None
+
+
+async def _open_main_selector(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    # button_callback đã answer() callback query trước khi điều phối.
+    await show_main_selector(update, context, edit=True, answered=True)
+
+
+# Bảng điều phối callback_data -> handler, dựng một lần khi import.
+_CALLBACK_HANDLERS: dict[str, Callable[[Update, ContextTypes.DEFAULT_TYPE], Awaitable[None]]] = {
+    "menu_shop": _open_main_selector,
+    "back_to_menu": show_outer_menu,
+    "cancel_update": _open_main_selector,
+    "delete": _noop,
+    "add": _noop,
+    "unpaid_orders": _noop,
+    "exit_unpaid": _noop,
+    "payment_source": _noop,
+}
+_NAV_CALLBACKS = frozenset({"nav_next", "nav_prev"})
+
+
 @user_only_filter
 async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     data = query.data
     await query.answer()
 
-    if data == "menu_shop":
-        await show_main_selector(update, context, edit=True)
-        return
-    if data == "back_to_menu":
-        await show_outer_menu(update, context)
-        return
-    if data == "cancel_update":
-        await show_main_selector(update, context, edit=True)
+    handler = _CALLBACK_HANDLERS.get(data)
+    if handler is not None:
+        await handler(update, context)
         return
-    if data.startswith("action_") or data in {"nav_next", "nav_prev"}:
+    if data.startswith("action_") or data in _NAV_CALLBACKS:
         await query.answer("Please open /update first.", show_alert=True)
         return
-    if data == "delete":
-        return
-    if data in {"add", "unpaid_orders", "exit_unpaid", "payment_source"}:
-        return
 
     await _send_coming_soon(update, data)
 
@@ -152,10 +158,30 @@ async def application_error_handler(update: object, context: ContextTypes.DEFAUL
 
 def build_application() -> Application:
     """Xây dựng và trả về đối tượng Application để sử dụng cho Webhook (Flask integration)."""
+    # Import trễ các module nặng để giảm thời gian khởi động tiến trình
+    from mavrykbot.handlers.add_order import get_add_order_conversation_handler
+    from mavrykbot.handlers.update_order import get_update_order_conversation_handler
+    from mavrykbot.handlers.view_due_orders import check_due_orders_job, test_due_orders_command
+    from mavrykbot.handlers.Payment_Supply import get_payment_supply_conversation_handler
+    from mavrykbot.handlers.View_order_unpaid import get_unpaid_order_conversation_handler
+
+    try:
+        from mavrykbot.handlers.create_qrcode import qr_conversation
+    except ImportError:  # pragma: no cover - optional feature
+        qr_conversation = CommandHandler(
+            "qr_placeholder",
+            lambda update, context: context.bot.send_message(
+                update.effective_chat.id,
+                "QR feature is not available yet.",
+            ),
+        )
+
     application = (
         Application.builder()
         .token(BOT_TOKEN)
         .rate_limiter(AIORateLimiter())
+        # Các chat khác nhau chạy song song; update trong cùng một chat vẫn tuần tự.
+        .concurrent_updates(PerChatUpdateProcessor())
         .build()
     )
     application.add_handler(CommandHandler("start", start))
@@ -6,22 +6,43 @@ import logging
 ADMIN_USER_IDS = [510811276]
 logger = logging.getLogger(__name__)
 
-async def show_outer_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    keyboard = [
-        [
-            InlineKeyboardButton("👤 Đơn Chưa Thanh Toán", callback_data='unpaid_orders'),
-            InlineKeyboardButton("🏬 Shop", callback_data='menu_shop')
-        ],
-        [
-            InlineKeyboardButton("💰 Tạo QR Thanh Toán", callback_data='create_qr'),
-            InlineKeyboardButton("💰 Thanh Toán Nguồn", callback_data='payment_source')
-        ],
-        [
-            InlineKeyboardButton("💸 Hoàn Tiền", callback_data='start_refund')
-        ]
+# Bàn phím menu không đổi giữa các lần gọi: dựng một lần khi import.
+_OUTER_KEYBOARD = [
+    [
+        InlineKeyboardButton("👤 Đơn Chưa Thanh Toán", callback_data='unpaid_orders'),
+        InlineKeyboardButton("🏬 Shop", callback_data='menu_shop')
+    ],
+    [
+        InlineKeyboardButton("💰 Tạo QR Thanh Toán", callback_data='create_qr'),
+        InlineKeyboardButton("💰 Thanh Toán Nguồn", callback_data='payment_source')
+    ],
+    [
+        InlineKeyboardButton("💸 Hoàn Tiền", callback_data='start_refund')
     ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    message_text = "🔽 *Chọn phân hệ làm việc:*"
+]
+_OUTER_MARKUP = InlineKeyboardMarkup(_OUTER_KEYBOARD)
+_OUTER_TEXT = "🔽 *Chọn phân hệ làm việc:*"
+
+_MAIN_KEYBOARD = [
+    [
+        InlineKeyboardButton("📝 Thêm Đơn", callback_data="add"),
+        InlineKeyboardButton("🔄 Xem/Chỉnh Đơn", callback_data="update"),
+    ],
+    [
+        InlineKeyboardButton("⬅️ Về menu chính", callback_data="back_to_menu"),
+    ],
+]
+_MAIN_MARKUP = InlineKeyboardMarkup(_MAIN_KEYBOARD)
+_MAIN_TEXT = "👉 Chọn chức năng:"
+
+
+def _is_not_modified(exc: telegram.error.BadRequest) -> bool:
+    return "message is not modified" in str(exc).lower()
+
+
+async def show_outer_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    reply_markup = _OUTER_MARKUP
+    message_text = _OUTER_TEXT
     query = update.callback_query
     try:
         if query:
@@ -48,6 +69,8 @@ async def show_outer_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 parse_mode='Markdown'
             )
     except telegram.error.BadRequest as e:
+        if _is_not_modified(e):
+            return
         logger.error(f"❌ Lỗi không mong muốn trong show_outer_menu: {e}")
         try:
             await update.effective_chat.send_message(
@@ -63,23 +86,16 @@ async def show_main_selector(
     context: ContextTypes.DEFAULT_TYPE,
     edit: bool = False,
     text: str | None = None,
+    answered: bool = False,
 ) -> None:
-    keyboard = [
-        [
-            InlineKeyboardButton("📝 Thêm Đơn", callback_data="add"),
-            InlineKeyboardButton("🔄 Xem/Chỉnh Đơn", callback_data="update"),
-        ],
-        [
-            InlineKeyboardButton("⬅️ Về menu chính", callback_data="back_to_menu"),
-        ],
-    ]
-    markup = InlineKeyboardMarkup(keyboard)
+    markup = _MAIN_MARKUP
     q = update.callback_query
     msg = q.message if q else update.effective_message
-    body = text or "👉 Chọn chức năng:"
+    body = text or _MAIN_TEXT
     try:
         if q:
-            await q.answer()
+            if not answered:
+                await q.answer()
             if getattr(msg, "text", None):
                 await msg.edit_text(body, reply_markup=markup, parse_mode="Markdown")
             else:
@@ -88,5 +104,7 @@ async def show_main_selector(
         else:
             await msg.reply_text(body, reply_markup=markup, parse_mode="Markdown")
     except telegram.error.BadRequest as e:
+        if _is_not_modified(e):
+            return
         logger.warning(f"show_main_selector BadRequest: {e}")
         await update.effective_chat.send_message(body, reply_markup=markup, parse_mode="Markdown")
@@ -4,7 +4,6 @@ from __future__ import annotations
 import logging
 import re
 from datetime import date as date_type, datetime, timedelta
-from decimal import Decimal
 
 from mavrykbot.core.database import db
 from mavrykbot.core.db_schema import (
@@ -23,6 +22,7 @@ logger = logging.getLogger(__name__)
 
 DATE_FMT = "%d/%m/%Y"
 DB_DATE_FMT = "%Y/%m/%d"
+_DURATION_RE = re.compile(r"--\s*(\d+)\s*m", re.IGNORECASE)
 
 
 def _parse_date(value) -> datetime | None:
@@ -33,11 +33,24 @@ def _parse_date(value) -> datetime | None:
     if isinstance(value, date_type):
         return datetime.combine(value, datetime.min.time())
     value_str = str(value).strip()
-    for fmt in (DATE_FMT, "%Y-%m-%d", "%Y/%m/%d"):
+    if len(value_str) >= 10 and value_str[4] in "-/":
+        # Dạng lưu trong DB (YYYY/MM/DD, YYYY-MM-DD[ HH:MM:SS]): chuẩn hoá về ISO rồi
+        # dùng fromisoformat, nhanh hơn strptime nhiều lần.
+        try:
+            return datetime.fromisoformat(value_str.replace("/", "-"))
+        except ValueError:
+            pass
+    # Chọn đúng một format theo vị trí dấu phân cách, tránh thử-sai bằng exception.
+    fmt = None
+    if len(value_str) > 4 and value_str[4] in "-/":
+        fmt = "%Y-%m-%d" if value_str[4] == "-" else "%Y/%m/%d"
+    elif "/" in value_str[1:3]:
+        fmt = DATE_FMT
+    if fmt:
         try:
             return datetime.strptime(value_str, fmt)
-        except Exception:
-            continue
+        except ValueError:
+            pass
     try:
         return datetime.fromisoformat(value_str)
     except Exception:
@@ -64,77 +77,58 @@ def tinh_ngay_het_han(ngay_dang_ky_str: str, so_ngay_str: str) -> str:
     return _format_date(end_date)
 
 
-def _fetch_order(order_id: str):
-    query = f"""
-        SELECT
-            {OrderListColumns.SAN_PHAM},
-            {OrderListColumns.HET_HAN},
-            {OrderListColumns.NGUON},
-            {OrderListColumns.GIA_NHAP},
-            {OrderListColumns.GIA_BAN},
-            {OrderListColumns.THONG_TIN_SAN_PHAM},
-            {OrderListColumns.SLOT},
-            {OrderListColumns.NGAY_DANG_KI},
-            {OrderListColumns.TINH_TRANG},
-            {OrderListColumns.CHECK_FLAG}
-        FROM {ORDER_LIST_TABLE}
-        WHERE {OrderListColumns.ID_DON_HANG} = %s
-    """
-    return db.fetch_one(query, (order_id,))
-
-
-def _get_product_record(san_pham: str):
-    query = f"""
+# Một truy vấn gom đơn hàng + sản phẩm + nguồn + giá nguồn + giá cao nhất,
+# thay cho năm lần fetch_one tuần tự trong run_renewal.
+_RENEWAL_CONTEXT_SQL = f"""
+    SELECT
+        o.{OrderListColumns.ID_DON_HANG},
+        o.{OrderListColumns.SAN_PHAM},
+        o.{OrderListColumns.HET_HAN},
+        o.{OrderListColumns.NGUON},
+        o.{OrderListColumns.GIA_NHAP},
+        o.{OrderListColumns.GIA_BAN},
+        o.{OrderListColumns.THONG_TIN_SAN_PHAM},
+        o.{OrderListColumns.SLOT},
+        o.{OrderListColumns.NGAY_DANG_KI},
+        o.{OrderListColumns.TINH_TRANG},
+        o.{OrderListColumns.CHECK_FLAG},
+        p.{ProductPriceColumns.ID},
+        p.{ProductPriceColumns.PCT_CTV},
+        p.{ProductPriceColumns.PCT_KHACH},
+        sp.{SupplyPriceColumns.PRICE},
+        mx.max_price
+    FROM {ORDER_LIST_TABLE} o
+    LEFT JOIN LATERAL (
         SELECT {ProductPriceColumns.ID}, {ProductPriceColumns.PCT_CTV}, {ProductPriceColumns.PCT_KHACH}
         FROM {PRODUCT_PRICE_TABLE}
-        WHERE LOWER({ProductPriceColumns.SAN_PHAM}) = LOWER(%s)
+        WHERE LOWER({ProductPriceColumns.SAN_PHAM}) = LOWER(COALESCE(o.{OrderListColumns.SAN_PHAM}, ''))
         LIMIT 1
-    """
-    return db.fetch_one(query, (san_pham,))
-
-
-def _get_source_id(source_name: str | None):
-    if not source_name:
-        return None
-    query = f"""
+    ) p ON TRUE
+    LEFT JOIN LATERAL (
         SELECT {SupplyColumns.ID}
         FROM {SUPPLY_TABLE}
-        WHERE LOWER({SupplyColumns.SOURCE_NAME}) = LOWER(%s)
+        WHERE LOWER({SupplyColumns.SOURCE_NAME}) = LOWER(NULLIF(o.{OrderListColumns.NGUON}, ''))
         LIMIT 1
-    """
-    res = db.fetch_one(query, (source_name,))
-    return res[0] if res else None
-
-
-def _get_source_price(product_id, source_id):
-    if not (product_id and source_id):
-        return None
-    query = f"""
+    ) s ON TRUE
+    LEFT JOIN LATERAL (
         SELECT {SupplyPriceColumns.PRICE}
         FROM {SUPPLY_PRICE_TABLE}
-        WHERE {SupplyPriceColumns.PRODUCT_ID} = %s AND {SupplyPriceColumns.SOURCE_ID} = %s
+        WHERE {SupplyPriceColumns.PRODUCT_ID} = p.{ProductPriceColumns.ID}
+          AND {SupplyPriceColumns.SOURCE_ID} = s.{SupplyColumns.ID}
         LIMIT 1
-    """
-    res = db.fetch_one(query, (product_id, source_id))
-    price = res[0] if res else None
-    return int(price) if price is not None else None
-
-
-def _get_highest_price(product_id):
-    if not product_id:
-        return None
-    query = f"""
-        SELECT MAX({SupplyPriceColumns.PRICE})
+    ) sp ON TRUE
+    LEFT JOIN LATERAL (
+        SELECT MAX({SupplyPriceColumns.PRICE}) AS max_price
         FROM {SUPPLY_PRICE_TABLE}
-        WHERE {SupplyPriceColumns.PRODUCT_ID} = %s
-    """
-    res = db.fetch_one(query, (product_id,))
-    price = res[0] if res else None
-    return Decimal(price) if price is not None else None
+        WHERE {SupplyPriceColumns.PRODUCT_ID} = p.{ProductPriceColumns.ID}
+    ) mx ON TRUE
+    WHERE o.{OrderListColumns.ID_DON_HANG} = ANY(%s)
+"""
 
 
-def _calc_gia_ban(order_id: str, highest_price: Decimal | None, pct_ctv: Decimal, pct_khach: Decimal, gia_nhap: int) -> int:
-    gia_ban = Decimal(gia_nhap)
+def _calc_gia_ban(order_id: str, highest_price: int | None, pct_ctv: float, pct_khach: float, gia_nhap: int) -> int:
+    # Kết quả làm tròn lên hàng nghìn nên float là đủ chính xác; không cần Decimal.
+    gia_ban: float = gia_nhap
     ma = order_id.upper()
     try:
         if highest_price and highest_price > 0:
@@ -144,69 +138,43 @@ def _calc_gia_ban(order_id: str, highest_price: Decimal | None, pct_ctv: Decimal
                 gia_ctv = highest_price * pct_ctv
                 gia_ban = gia_ctv * pct_khach
         if ma.startswith("MAVK"):
-            gia_ban = Decimal(gia_nhap)
+            gia_ban = gia_nhap
     except Exception:  # pragma: no cover - defensive
         logger.exception("Lỗi khi tính giá bán cho %s", order_id)
-        gia_ban = Decimal(gia_nhap)
-    return int(((int(gia_ban) + 999) // 1000) * 1000)
+        gia_ban = gia_nhap
+    # +1e-6 bù sai số float (vd 28999.999999999996) trước khi cắt phần thập phân.
+    return (int(gia_ban + 1e-6) + 999) // 1000 * 1000
 
 
-def _as_bool(value) -> bool:
-    if isinstance(value, bool):
-        return value
-    if isinstance(value, str):
-        return value.strip().lower() in {"true", "t", "1", "yes"}
-    return bool(value)
+def _round_to_thousands(value: int) -> int:
+    numeric = int(value)
+    remainder = numeric % 1000
+    return numeric - remainder + (1000 if remainder >= 500 else 0)
 
 
-def _round_to_thousands(value: int | Decimal) -> int:
-    numeric = int(Decimal(value))
-    if numeric == 0:
-        return 0
-    remainder = numeric % 1000
-    if remainder == 0:
-        return numeric
-    return numeric + (1000 - remainder) if remainder >= 500 else numeric - remainder
-
-
-def _update_order(
-    order_id: str,
-    ngay_dang_ky: str,
-    so_ngay: int,
-    ngay_het_han: str,
-    gia_nhap: int,
-    gia_ban: int,
-    status: str,
-    check_flag: bool,
-):
-    sql = f"""
-        UPDATE {ORDER_LIST_TABLE}
-        SET
-            {OrderListColumns.NGAY_DANG_KI} = %s,
-            {OrderListColumns.SO_NGAY_DA_DANG_KI} = %s,
-            {OrderListColumns.HET_HAN} = %s,
-            {OrderListColumns.GIA_NHAP} = %s,
-            {OrderListColumns.GIA_BAN} = %s,
-            {OrderListColumns.TINH_TRANG} = %s,
-            {OrderListColumns.CHECK_FLAG} = %s
-        WHERE {OrderListColumns.ID_DON_HANG} = %s
-    """
-    db.execute(sql, (ngay_dang_ky, str(so_ngay), ngay_het_han, gia_nhap, gia_ban, status, check_flag, order_id))
+_UPDATE_RENEWAL_SQL = f"""
+    UPDATE {ORDER_LIST_TABLE}
+    SET
+        {OrderListColumns.NGAY_DANG_KI} = %s,
+        {OrderListColumns.SO_NGAY_DA_DANG_KI} = %s,
+        {OrderListColumns.HET_HAN} = %s,
+        {OrderListColumns.GIA_NHAP} = %s,
+        {OrderListColumns.GIA_BAN} = %s,
+        {OrderListColumns.TINH_TRANG} = %s,
+        {OrderListColumns.CHECK_FLAG} = %s
+    WHERE {OrderListColumns.ID_DON_HANG} = %s
+"""
 
 
-def run_renewal(order_id: str):
+def _plan_renewal(order_id: str, order_row, today: datetime):
     """
-    Renew an order if it will expire in <= 4 days.
+    Tính toán gia hạn cho một đơn (thuần CPU, không chạm DB).
 
-    Returns tuple (success: bool, details: str|dict, process_type: str)
+    Returns (result, update_params) — update_params là None khi không cần ghi DB.
     """
-    if not order_id:
-        return False, "Mã đơn hàng không được để trống.", "error"
-
-    order_row = _fetch_order(order_id)
     if not order_row:
         logger.warning("Không tìm thấy đơn hàng %s trong order_list.", order_id)
-        return False, f"Không tìm thấy đơn hàng {order_id}", "error"
+        return (False, f"Không tìm thấy đơn hàng {order_id}", "error"), None
 
     (
         san_pham,
@@ -219,40 +187,36 @@ def run_renewal(order_id: str):
         ngay_dang_ky_cu,
         tinh_trang,
         check_flag,
+        product_id,
+        pct_ctv_raw,
+        pct_khach_raw,
+        gia_nhap_source,
+        highest_price,
     ) = order_row
 
     het_han_dt = _parse_date(ngay_het_han_str or "")
     if not het_han_dt:
-        return False, f"Ngày hết hạn không hợp lệ cho đơn {order_id}", "error"
+        return (False, f"Ngày hết hạn không hợp lệ cho đơn {order_id}", "error"), None
 
-    today = datetime.now()
     so_ngay_con_lai = (het_han_dt - today).days
     if so_ngay_con_lai > 4:
         logger.info("Đơn %s còn %s ngày, bỏ qua.", order_id, so_ngay_con_lai)
-        return False, "Bỏ qua do còn nhiều ngày", "skipped"
+        return (False, "Bỏ qua do còn nhiều ngày", "skipped"), None
 
     san_pham_norm = normalize_product_duration(san_pham or "")
-    match_thoi_han = re.search(r"--\s*(\d+)\s*m", san_pham_norm, flags=re.I)
+    match_thoi_han = _DURATION_RE.search(san_pham_norm)
     if not match_thoi_han:
-        return False, f"Không thể xác định thời hạn từ sản phẩm '{san_pham}'.", "error"
+        return (False, f"Không thể xác định thời hạn từ sản phẩm '{san_pham}'.", "error"), None
 
     so_thang = int(match_thoi_han.group(1))
     so_ngay_gia_han = 365 if so_thang == 12 else so_thang * 30
 
-    product_record = _get_product_record(san_pham or "")
-    product_id = pct_ctv = pct_khach = None
-    if product_record:
-        product_id = product_record[0]
-        pct_ctv = Decimal(str(product_record[1])) if product_record[1] is not None else Decimal("1.0")
-        pct_khach = Decimal(str(product_record[2])) if product_record[2] is not None else Decimal("1.0")
-    else:
-        pct_ctv = pct_khach = Decimal("1.0")
+    pct_ctv = float(pct_ctv_raw) if pct_ctv_raw is not None else 1.0
+    pct_khach = float(pct_khach_raw) if pct_khach_raw is not None else 1.0
 
-    source_id = _get_source_id(nguon_hang)
-    gia_nhap_source = _get_source_price(product_id, source_id)
-    final_gia_nhap = gia_nhap_source if gia_nhap_source is not None else chuan_hoa_gia(gia_nhap_cu)[1]
+    final_gia_nhap = int(gia_nhap_source) if gia_nhap_source is not None else chuan_hoa_gia(gia_nhap_cu)[1]
 
-    highest_price = _get_highest_price(product_id)
+    highest_price = int(highest_price) if highest_price is not None else None
     final_gia_ban = _calc_gia_ban(order_id, highest_price, pct_ctv, pct_khach, final_gia_nhap)
 
     final_gia_nhap = _round_to_thousands(final_gia_nhap)
@@ -268,21 +232,16 @@ def run_renewal(order_id: str):
     new_status = "Chua Thanh Toan"
     new_check_flag = False
 
-    try:
-        _update_order(
-            order_id,
-            ngay_bat_dau_moi_db,
-            so_ngay_gia_han,
-            ngay_het_han_moi_db,
-            final_gia_nhap,
-            final_gia_ban,
-            new_status,
-            new_check_flag,
-        )
-    except Exception as exc:  # pragma: no cover - defensive logging
-        logger.error("Không thể cập nhật đơn %s: %s", order_id, exc)
-        return False, f"Lỗi cập nhật database: {exc}", "error"
-
+    update_params = (
+        ngay_bat_dau_moi_db,
+        str(so_ngay_gia_han),
+        ngay_het_han_moi_db,
+        final_gia_nhap,
+        final_gia_ban,
+        new_status,
+        new_check_flag,
+        order_id,
+    )
     updated_details = {
         "ID_DON_HANG": order_id,
         "SAN_PHAM": san_pham,
@@ -295,5 +254,52 @@ def run_renewal(order_id: str):
         "GIA_BAN": final_gia_ban,
         "TINH_TRANG": new_status,
     }
-    logger.info("Gia hạn thành công đơn %s.", order_id)
-    return True, updated_details, "renewal"
+    return (True, updated_details, "renewal"), update_params
+
+
+def run_renewal_bulk(order_ids: list[str]) -> list[tuple]:
+    """
+    Renew many orders with one SELECT and one batched UPDATE, committed once.
+
+    Returns a list of (success, details, process_type) aligned with `order_ids`.
+    """
+    empty_result = (False, "Mã đơn hàng không được để trống.", "error")
+    ids = [oid for oid in dict.fromkeys(order_ids) if oid]
+    if not ids:
+        return [empty_result for _ in order_ids]
+
+    today = datetime.now()
+    results: dict[str, tuple] = {}
+    pending: list[tuple] = []
+
+    # Một SELECT gộp cho cả lượt, rồi mọi UPDATE đi chung một execute_batch (một transaction).
+    rows = db.fetch_all(_RENEWAL_CONTEXT_SQL, (ids,))
+    contexts = {row[0]: row[1:] for row in rows}
+
+    for oid in ids:
+        result, update_params = _plan_renewal(oid, contexts.get(oid), today)
+        results[oid] = result
+        if update_params is not None:
+            pending.append(update_params)
+
+    if pending:
+        try:
+            db.execute_batch(_UPDATE_RENEWAL_SQL, pending)
+        except Exception as exc:  # pragma: no cover - defensive logging
+            logger.error("Không thể cập nhật %s đơn gia hạn: %s", len(pending), exc)
+            for params in pending:
+                results[params[-1]] = (False, f"Lỗi cập nhật database: {exc}", "error")
+        else:
+            for params in pending:
+                logger.info("Gia hạn thành công đơn %s.", params[-1])
+
+    return [results.get(oid, empty_result) for oid in order_ids]
+
+
+def run_renewal(order_id: str):
+    """
+    Renew an order if it will expire in <= 4 days.
+
+    Returns tuple (success: bool, details: str|dict, process_type: str)
+    """
+    return run_renewal_bulk([order_id])[0]
@@ -1,7 +1,8 @@
 ﻿import asyncio
 import logging
 import re
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from functools import lru_cache
 from datetime import date, datetime, timedelta
 from decimal import Decimal
 from typing import Dict, List, Optional, Sequence
@@ -28,13 +29,20 @@ from mavrykbot.core.db_schema import (
     SupplyColumns,
     SupplyPriceColumns,
 )
-from mavrykbot.core.utils import chuan_hoa_gia, escape_mdv2, normalize_product_duration
+from mavrykbot.core.utils import (
+    MDV2_ESCAPE_TABLE,
+    chuan_hoa_gia,
+    escape_mdv2,
+    normalize_product_duration,
+)
 from mavrykbot.handlers.add_order import tinh_ngay_het_han
 from mavrykbot.handlers.menu import show_main_selector
 
 logger = logging.getLogger(__name__)
 
 DATE_FMT = "%d/%m/%Y"
+_PCT_SCALE = 10_000
+BUILD_IN_THREAD_THRESHOLD = 20  # số dòng kết quả tìm kiếm
 
 (
     SELECT_MODE,
@@ -49,7 +57,7 @@ DATE_FMT = "%d/%m/%Y"
 ) = range(9)
 
 
-@dataclass
+@dataclass(slots=True)
 class OrderRecord:
     db_id: int
     ma_don: str
@@ -65,6 +73,12 @@ class OrderRecord:
     note: str
     ten_khach: str
     link_khach: str
+    # Lấy sẵn từ product_price khi tìm đơn để gia hạn không phải tra lại.
+    product_id: Optional[int] = None
+    pct_ctv: Optional[Decimal] = None
+    pct_khach: Optional[Decimal] = None
+    # (ngày render, text MarkdownV2) — xoá về None mỗi khi đơn bị sửa.
+    _rendered: Optional[tuple] = field(default=None, repr=False, compare=False)
 
 
 ORDER_SELECT_FIELDS: Sequence[str] = (
@@ -148,6 +162,111 @@ FIELD_MENU_LAYOUT: List[List[Optional[str]]] = [
 ]
 
 
+# =============================
+# Bàn phím tĩnh — dựng một lần khi import
+# =============================
+_EDIT_FIELD_MARKUP = InlineKeyboardMarkup(
+    [
+        [
+            InlineKeyboardButton(str(FIELD_CONFIG[key]["label"]), callback_data=f"edit|{key}")
+            for key in row
+            if key
+        ]
+        for row in FIELD_MENU_LAYOUT
+        if any(row)
+    ]
+    + [[InlineKeyboardButton("Quay Lại", callback_data="back_to_order")]]
+)
+_CANCEL_MARKUP = InlineKeyboardMarkup(
+    [[InlineKeyboardButton("Hủy", callback_data="cancel_update")]]
+)
+_LINK_KHACH_MARKUP = InlineKeyboardMarkup(
+    [
+        [InlineKeyboardButton("Bỏ trống", callback_data="skip_link_khach")],
+        [InlineKeyboardButton("Hủy", callback_data="cancel_update")],
+    ]
+)
+
+
+# =============================
+# Câu SQL cố định — dựng một lần khi import
+# =============================
+_ORDER_SELECT_CSV = ", ".join(f"o.{col}" for col in ORDER_SELECT_FIELDS)
+
+# Ghép hồ sơ sản phẩm (id, pct_ctv, pct_khach) vào mỗi dòng kết quả tìm kiếm.
+_ORDER_SEARCH_FROM = f"""
+    SELECT {_ORDER_SELECT_CSV},
+           pp.{ProductPriceColumns.ID},
+           pp.{ProductPriceColumns.PCT_CTV},
+           pp.{ProductPriceColumns.PCT_KHACH}
+    FROM {ORDER_LIST_TABLE} o
+    LEFT JOIN LATERAL (
+        SELECT {ProductPriceColumns.ID},
+               {ProductPriceColumns.PCT_CTV},
+               {ProductPriceColumns.PCT_KHACH}
+        FROM {PRODUCT_PRICE_TABLE}
+        WHERE LOWER({ProductPriceColumns.SAN_PHAM}) = LOWER(o.{OrderListColumns.SAN_PHAM})
+        LIMIT 1
+    ) pp ON TRUE
+"""
+
+_SQL_ORDER_BY_ID = f"""{_ORDER_SEARCH_FROM}
+    WHERE LOWER(o.{OrderListColumns.ID_DON_HANG}) = LOWER(%s)
+    ORDER BY o.{OrderListColumns.ID} DESC
+"""
+
+_SQL_ORDER_BY_INFO = f"""{_ORDER_SEARCH_FROM}
+    WHERE o.{OrderListColumns.THONG_TIN_SAN_PHAM} ILIKE %s
+       OR o.{OrderListColumns.SAN_PHAM} ILIKE %s
+    ORDER BY o.{OrderListColumns.ID} DESC
+"""
+
+_SQL_EXTEND_PRICES = f"""
+    SELECT
+        (
+            SELECT sp.{SupplyPriceColumns.PRICE}
+            FROM {SUPPLY_PRICE_TABLE} sp
+            JOIN {SUPPLY_TABLE} s
+              ON sp.{SupplyPriceColumns.SOURCE_ID} = s.{SupplyColumns.ID}
+            WHERE sp.{SupplyPriceColumns.PRODUCT_ID} = %(product_id)s
+              AND LOWER(s.{SupplyColumns.SOURCE_NAME}) = LOWER(%(source_name)s)
+            LIMIT 1
+        ) AS nguon_price,
+        (
+            SELECT MAX({SupplyPriceColumns.PRICE})
+            FROM {SUPPLY_PRICE_TABLE}
+            WHERE {SupplyPriceColumns.PRODUCT_ID} = %(product_id)s
+        ) AS highest_price
+"""
+
+_SQL_EXTEND_ORDER = f"""
+    UPDATE {ORDER_LIST_TABLE}
+    SET {OrderListColumns.NGAY_DANG_KI} = %s,
+        {OrderListColumns.SO_NGAY_DA_DANG_KI} = %s,
+        {OrderListColumns.HET_HAN} = %s,
+        {OrderListColumns.GIA_NHAP} = %s,
+        {OrderListColumns.GIA_BAN} = %s
+    WHERE {OrderListColumns.ID} = %s
+"""
+
+_SQL_DELETE_ORDER = f"""
+    DELETE FROM {ORDER_LIST_TABLE}
+    WHERE {OrderListColumns.ID} = %s
+    RETURNING {OrderListColumns.ID}
+"""
+
+_SQL_SOURCE_EXISTS = f"""
+    SELECT 1 FROM {SUPPLY_TABLE}
+    WHERE LOWER({SupplyColumns.SOURCE_NAME}) = LOWER(%s)
+    LIMIT 1
+"""
+
+_SQL_UPDATE_FIELD: Dict[str, str] = {
+    key: f"UPDATE {ORDER_LIST_TABLE} SET {cfg['column']} = %s WHERE {OrderListColumns.ID} = %s"
+    for key, cfg in FIELD_CONFIG.items()
+}
+
+
 def _today() -> date:
     return datetime.now().date()
 
@@ -157,8 +276,7 @@ def _format_date(value: Optional[date]) -> str:
 
 
 def _format_currency(value: Optional[int]) -> str:
-    amount = int(value or 0)
-    return "{:,}".format(amount).replace(",", ".")
+    return f"{int(value or 0):_}".replace("_", ".")
 
 
 def _parse_date(value) -> Optional[date]:
@@ -168,9 +286,20 @@ def _parse_date(value) -> Optional[date]:
         return value.date()
     if isinstance(value, date):
         return value
+    text = str(value)
+    # Đường nhanh cho hai định dạng chuẩn YYYY-MM-DD và DD/MM/YYYY.
+    if len(text) == 10:
+        try:
+            if text[4] == "-" and text[7] == "-":
+                return date(int(text[:4]), int(text[5:7]), int(text[8:]))
+            if text[2] == "/" and text[5] == "/":
+                return date(int(text[6:]), int(text[3:5]), int(text[:2]))
+        except ValueError:
+            return None
+    # Dạng không đệm số 0 (vd 2/1/2025) vẫn đi qua strptime như trước.
     for fmt in ("%Y-%m-%d", DATE_FMT):
         try:
-            return datetime.strptime(str(value), fmt).date()
+            return datetime.strptime(text, fmt).date()
         except ValueError:
             continue
     return None
@@ -183,44 +312,70 @@ def _parse_positive_int(value) -> int:
         return 0
 
 
-def _remaining_days(order: OrderRecord) -> Optional[int]:
+def _remaining_days(order: OrderRecord, today: date) -> Optional[int]:
     if not order.het_han:
         return None
-    return (order.het_han - _today()).days
+    return (order.het_han - today).days
 
 
-def _remaining_value(order: OrderRecord) -> Optional[int]:
-    remaining = _remaining_days(order)
+def _remaining_value(order: OrderRecord, today: date) -> Optional[int]:
+    remaining = _remaining_days(order, today)
     if remaining is None or order.so_ngay <= 0 or order.gia_ban <= 0:
         return None
-    remaining = max(remaining, 0)
-    per_day = Decimal(order.gia_ban) / Decimal(max(order.so_ngay, 1))
-    return int(per_day * remaining)
+    return order.gia_ban * max(remaining, 0) // order.so_ngay
+
+
+def _scale_pct(value) -> int:
+    """Hệ số giá (vd 1.15) -> số nguyên theo _PCT_SCALE (11500) để tính giá bằng int."""
+    return int(Decimal(str(value or 1)) * _PCT_SCALE)
+
+
+def _parse_duration_months(text: str) -> Optional[int]:
+    """Số tháng từ hậu tố "--<N>m" đầu tiên trong tên sản phẩm (vd "Netflix --12m")."""
+    n = len(text)
+    i = text.find("--")
+    while i >= 0:
+        j = i + 2
+        while j < n and text[j].isspace():
+            j += 1
+        start = j
+        while j < n and "0" <= text[j] <= "9":
+            j += 1
+        end = j
+        while j < n and text[j].isspace():
+            j += 1
+        if end > start and j < n and text[j] in "mM":
+            return int(text[start:end])
+        i = text.find("--", i + 1)
+    return None
 
 
 def _round_up_to_thousand(value: int) -> int:
-    if value <= 0:
-        return 0
-    return ((int(value) + 999) // 1000) * 1000
-
-
-def _build_order(row: Sequence) -> OrderRecord:
-    return OrderRecord(
-        db_id=int(row[0]),
-        ma_don=str(row[1] or "").strip(),
-        san_pham=str(row[2] or "").strip(),
-        thong_tin=str(row[3] or "").strip(),
-        ten_khach=str(row[4] or "").strip(),
-        link_khach=str(row[5] or "").strip(),
-        slot=str(row[6] or "").strip(),
-        ngay_dang_ky=_parse_date(row[7]),
-        so_ngay=_parse_positive_int(row[8]),
-        het_han=_parse_date(row[9]),
-        nguon=str(row[10] or "").strip(),
-        gia_nhap=_parse_positive_int(row[11]),
-        gia_ban=_parse_positive_int(row[12]),
-        note=str(row[13] or "").strip(),
-    )
+    return (max(value, 0) + 999) // 1000 * 1000
+
+
+def _text(value) -> str:
+    return str(value or "").strip()
+
+
+def _build_orders(rows: Sequence[Sequence]) -> List[OrderRecord]:
+    """Dựng OrderRecord cho cả lô; hàm hay dùng được gán vào biến cục bộ cho vòng lặp."""
+    record, text, parse_date, parse_int = OrderRecord, _text, _parse_date, _parse_positive_int
+    orders: List[OrderRecord] = []
+    append = orders.append
+    for (
+        db_id, ma_don, san_pham, thong_tin, ten_khach, link_khach, slot,
+        ngay_dang_ky, so_ngay, het_han, nguon, gia_nhap, gia_ban, note,
+        product_id, pct_ctv, pct_khach,
+    ) in rows:
+        # Tham số theo đúng thứ tự khai báo trường của OrderRecord.
+        append(record(
+            int(db_id), text(ma_don), text(san_pham), text(thong_tin), text(slot),
+            parse_date(ngay_dang_ky), parse_int(so_ngay), parse_date(het_han),
+            text(nguon), parse_int(gia_nhap), parse_int(gia_ban), text(note),
+            text(ten_khach), text(link_khach), product_id, pct_ctv, pct_khach,
+        ))
+    return orders
 
 
 def _get_active_order(context: ContextTypes.DEFAULT_TYPE) -> OrderRecord:
@@ -231,45 +386,98 @@ def _get_active_order(context: ContextTypes.DEFAULT_TYPE) -> OrderRecord:
     return matched[min(max(index, 0), len(matched) - 1)]
 
 
-def _format_order_message(order: OrderRecord) -> str:
+def _esc(value: str) -> str:
+    # Mọi trường của OrderRecord đã là str nên bỏ qua bước ép kiểu của escape_mdv2.
+    return value.translate(MDV2_ESCAPE_TABLE)
+
+
+def _format_order_message(order: OrderRecord, today: Optional[date] = None) -> str:
+    if today is None:
+        today = _today()
     ngay_dk = _format_date(order.ngay_dang_ky)
     het_han = _format_date(order.het_han)
-    con_lai_val = _remaining_days(order)
+    con_lai_val = _remaining_days(order, today)
     con_lai = f"{max(con_lai_val, 0)} ngày" if con_lai_val is not None else "Không rõ"
-    gia_tri_con_lai_val = _remaining_value(order)
+    gia_tri_con_lai_val = _remaining_value(order, today)
     gia_tri_con_lai = (
         _format_currency(gia_tri_con_lai_val)
         if gia_tri_con_lai_val is not None
         else "0"
     )
     bullet = "\\- "
-    text = (
-        "*CHI TIẾT ĐƠN HÀNG*\n"
-        f"Mã Đơn: `{escape_mdv2(order.ma_don)}`\n\n"
-        "*THÔNG TIN SẢN PHẨM*\n"
-        f"{bullet}Sản Phẩm: {escape_mdv2(order.san_pham)}\n"
-        f"{bullet}Thông Tin: {escape_mdv2(order.thong_tin)}\n"
-    )
+    parts = [
+        "*CHI TIẾT ĐƠN HÀNG*",
+        f"Mã Đơn: `{_esc(order.ma_don)}`",
+        "",
+        "*THÔNG TIN SẢN PHẨM*",
+        f"{bullet}Sản Phẩm: {_esc(order.san_pham)}",
+        f"{bullet}Thông Tin: {_esc(order.thong_tin)}",
+    ]
     if order.slot:
-        text += f"{bullet}Slot: {escape_mdv2(order.slot)}\n"
-    text += (
-        f"{bullet}Ngày Đăng Ký: {escape_mdv2(ngay_dk)}\n"
-        f"{bullet}Số Ngày: {escape_mdv2(str(order.so_ngay))}\n"
-        f"{bullet}Hết Hạn: {escape_mdv2(het_han)}\n"
-        f"{bullet}Còn Lại: {escape_mdv2(con_lai)}\n"
-        f"{bullet}Nhà Cung Cấp: {escape_mdv2(order.nguon)}\n"
-        f"{bullet}Giá Nhập: {escape_mdv2(_format_currency(order.gia_nhap))}\n"
-        f"{bullet}Giá Bán: {escape_mdv2(_format_currency(order.gia_ban))}\n"
-        f"{bullet}Giá Trị Còn Lại: {escape_mdv2(gia_tri_con_lai)}\n"
-        f"{bullet}Ghi Chú: {escape_mdv2(order.note)}\n\n"
-        "*THÔNG TIN KHÁCH HÀNG*\n"
-        f"{bullet}Tên Khách Hàng: {escape_mdv2(order.ten_khach)}\n"
+        parts.append(f"{bullet}Slot: {_esc(order.slot)}")
+    parts += (
+        f"{bullet}Ngày Đăng Ký: {_esc(ngay_dk)}",
+        f"{bullet}Số Ngày: {_esc(str(order.so_ngay))}",
+        f"{bullet}Hết Hạn: {_esc(het_han)}",
+        f"{bullet}Còn Lại: {_esc(con_lai)}",
+        f"{bullet}Nhà Cung Cấp: {_esc(order.nguon)}",
+        f"{bullet}Giá Nhập: {_esc(_format_currency(order.gia_nhap))}",
+        f"{bullet}Giá Bán: {_esc(_format_currency(order.gia_ban))}",
+        f"{bullet}Giá Trị Còn Lại: {_esc(gia_tri_con_lai)}",
+        f"{bullet}Ghi Chú: {_esc(order.note)}",
+        "",
+        "*THÔNG TIN KHÁCH HÀNG*",
+        f"{bullet}Tên Khách Hàng: {_esc(order.ten_khach)}",
     )
-    if order.link_khach:
-        text += f"{bullet}Liên Hệ: {escape_mdv2(order.link_khach)}"
+    # Phần tử cuối luôn có mặt để giữ dấu xuống dòng sau tên khách như trước.
+    parts.append(f"{bullet}Liên Hệ: {_esc(order.link_khach)}" if order.link_khach else "")
+    return "\n".join(parts)
+
+
+def _render_order_message(order: OrderRecord) -> str:
+    """_format_order_message có cache theo ngày; chuyển trang qua lại không phải dựng lại."""
+    today = _today()
+    cached = order._rendered
+    if cached is not None and cached[0] == today:
+        return cached[1]
+    text = _format_order_message(order, today)
+    order._rendered = (today, text)
     return text
 
 
+def _invalidate_render(order: OrderRecord) -> None:
+    order._rendered = None
+
+
+@lru_cache(maxsize=256)
+def _order_action_markup(total: int, index: int, ma_don: str) -> InlineKeyboardMarkup:
+    buttons: List[List[InlineKeyboardButton]] = []
+    nav_row: List[InlineKeyboardButton] = []
+    if total > 1:
+        if index > 0:
+            nav_row.append(InlineKeyboardButton("Quay lại", callback_data="nav_prev"))
+        if index < total - 1:
+            nav_row.append(InlineKeyboardButton("Tiếp", callback_data="nav_next"))
+    if nav_row:
+        buttons.append(nav_row)
+
+    buttons.append(
+        [
+            InlineKeyboardButton("Gia hạn", callback_data=f"action_extend|{ma_don}"),
+            InlineKeyboardButton("Xóa", callback_data=f"action_delete|{ma_don}"),
+            InlineKeyboardButton("Sửa", callback_data=f"action_edit|{ma_don}"),
+        ]
+    )
+    buttons.append(
+        [InlineKeyboardButton("Hủy & về menu", callback_data="cancel_update")]
+    )
+    return InlineKeyboardMarkup(buttons)
+
+
+def _is_not_modified(exc: BadRequest) -> bool:
+    return "message is not modified" in str(exc).lower()
+
+
 async def _edit_or_send_main_message(
     context: ContextTypes.DEFAULT_TYPE,
     chat_id: int,
@@ -297,6 +505,9 @@ async def _edit_or_send_main_message(
         )
         context.user_data["main_message_id"] = sent.message_id
     except TelegramError as exc:
+        if isinstance(exc, BadRequest) and _is_not_modified(exc):
+            # Tin nhắn đang hiển thị đúng nội dung này: không gửi thêm tin trùng.
+            return
         logger.warning("Cannot edit message (%s). Sending new message.", exc)
         sent = await context.bot.send_message(
             chat_id=chat_id,
@@ -353,28 +564,22 @@ async def _update_prompt_message(
 
 
 
-def _query_orders_by_id(search_term: str) -> List[OrderRecord]:
-    sql = f"""
-        SELECT {", ".join(ORDER_SELECT_FIELDS)}
-        FROM {ORDER_LIST_TABLE}
-        WHERE LOWER({OrderListColumns.ID_DON_HANG}) = LOWER(%s)
-        ORDER BY {OrderListColumns.ID} DESC
-    """
-    rows = db.fetch_all(sql, (search_term.strip(),))
-    return [_build_order(row) for row in rows]
+async def _build_orders_async(rows: Sequence[Sequence]) -> List[OrderRecord]:
+    # Kết quả nhỏ dựng ngay trên event loop; chỉ kết quả lớn mới đáng tốn một lượt chuyển thread.
+    if len(rows) > BUILD_IN_THREAD_THRESHOLD:
+        return await asyncio.to_thread(_build_orders, rows)
+    return _build_orders(rows)
 
 
-def _query_orders_by_info(search_term: str) -> List[OrderRecord]:
-    sql = f"""
-        SELECT {", ".join(ORDER_SELECT_FIELDS)}
-        FROM {ORDER_LIST_TABLE}
-        WHERE {OrderListColumns.THONG_TIN_SAN_PHAM} ILIKE %s
-           OR {OrderListColumns.SAN_PHAM} ILIKE %s
-        ORDER BY {OrderListColumns.ID} DESC
-    """
+async def _query_orders_by_id(search_term: str) -> List[OrderRecord]:
+    rows = await db.fetch_all_async(_SQL_ORDER_BY_ID, (search_term.strip(),))
+    return await _build_orders_async(rows)
+
+
+async def _query_orders_by_info(search_term: str) -> List[OrderRecord]:
     like_term = f"%{search_term.strip()}%"
-    rows = db.fetch_all(sql, (like_term, like_term))
-    return [_build_order(row) for row in rows]
+    rows = await db.fetch_all_async(_SQL_ORDER_BY_INFO, (like_term, like_term))
+    return await _build_orders_async(rows)
 
 async def start_update_order(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     keyboard = [
@@ -410,9 +615,7 @@ async def select_check_mode(update: Update, context: ContextTypes.DEFAULT_TYPE)
     await query.edit_message_text(
         prompt,
         parse_mode="Markdown",
-        reply_markup=InlineKeyboardMarkup(
-            [[InlineKeyboardButton("Hủy", callback_data="cancel_update")]]
-        ),
+        reply_markup=_CANCEL_MARKUP,
     )
     return INPUT_VALUE
 
@@ -434,9 +637,9 @@ async def input_value_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
 
     try:
         if check_mode == "mode_id":
-            matched = _query_orders_by_id(search_term)
+            matched = await _query_orders_by_id(search_term)
         else:
-            matched = _query_orders_by_info(search_term)
+            matched = await _query_orders_by_info(search_term)
     except Exception as exc:
         logger.error("SQL search failed: %s", exc, exc_info=True)
         await _edit_or_send_main_message(
@@ -454,7 +657,7 @@ async def input_value_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
         )
         return await end_update(update, context)
 
-    context.user_data["matched_orders"] = matched
+    _set_matched_orders(context, matched)
     context.user_data["current_match_index"] = 0
     return await show_matched_order(update, context)
 
@@ -485,31 +688,10 @@ async def show_matched_order(
     context.user_data["current_match_index"] = index
 
     order = matched_orders[index]
-    message_text = _format_order_message(order)
+    message_text = _render_order_message(order)
     if success_notice:
         message_text = f"_{escape_mdv2(success_notice)}_\n\n{message_text}"
 
-    buttons: List[List[InlineKeyboardButton]] = []
-    nav_row: List[InlineKeyboardButton] = []
-    if len(matched_orders) > 1:
-        if index > 0:
-            nav_row.append(InlineKeyboardButton("Quay lại", callback_data="nav_prev"))
-        if index < len(matched_orders) - 1:
-            nav_row.append(InlineKeyboardButton("Tiếp", callback_data="nav_next"))
-    if nav_row:
-        buttons.append(nav_row)
-
-    buttons.append(
-        [
-            InlineKeyboardButton("Gia hạn", callback_data=f"action_extend|{order.ma_don}"),
-            InlineKeyboardButton("Xóa", callback_data=f"action_delete|{order.ma_don}"),
-            InlineKeyboardButton("Sửa", callback_data=f"action_edit|{order.ma_don}"),
-        ]
-    )
-    buttons.append(
-        [InlineKeyboardButton("Hủy & về menu", callback_data="cancel_update")]
-    )
-
     if len(matched_orders) > 1:
         message_text += f"\n\nKết quả ({index + 1}/{len(matched_orders)})"
 
@@ -518,76 +700,56 @@ async def show_matched_order(
         update.effective_chat.id,
         message_text,
         parse_mode="MarkdownV2",
-        reply_markup=InlineKeyboardMarkup(buttons),
+        reply_markup=_order_action_markup(len(matched_orders), index, order.ma_don),
     )
     return SELECT_ACTION
 
 
-def _find_order_by_ma(
-    orders: List[OrderRecord], ma_don: str
-) -> Optional[OrderRecord]:
-    ma_lower = ma_don.strip().lower()
+def _set_matched_orders(
+    context: ContextTypes.DEFAULT_TYPE, orders: List[OrderRecord]
+) -> None:
+    """Lưu danh sách kết quả kèm chỉ mục theo mã đơn (không phân biệt hoa thường)."""
+    by_ma: Dict[str, OrderRecord] = {}
     for record in orders:
-        if record.ma_don.lower() == ma_lower:
-            return record
-    return None
+        # Giữ bản ghi đầu tiên khi trùng mã, giống thứ tự hiển thị.
+        by_ma.setdefault(record.ma_don.lower(), record)
+    context.user_data["matched_orders"] = orders
+    context.user_data["matched_by_ma"] = by_ma
 
 
-def _lookup_product_profile(
-    product_name: str,
-) -> Optional[Sequence]:
-    sql = f"""
-        SELECT {ProductPriceColumns.ID},
-               {ProductPriceColumns.PCT_CTV},
-               {ProductPriceColumns.PCT_KHACH}
-        FROM {PRODUCT_PRICE_TABLE}
-        WHERE LOWER({ProductPriceColumns.SAN_PHAM}) = LOWER(%s)
-        LIMIT 1
-    """
-    return db.fetch_one(sql, (product_name.strip(),))
+def _find_order_by_ma(
+    context: ContextTypes.DEFAULT_TYPE, ma_don: str
+) -> Optional[OrderRecord]:
+    return context.user_data.get("matched_by_ma", {}).get(ma_don.strip().lower())
 
 
-def _lookup_source_price(product_id: int, source_name: str) -> Optional[int]:
-    sql = f"""
-        SELECT sp.{SupplyPriceColumns.PRICE}
-        FROM {SUPPLY_PRICE_TABLE} sp
-        JOIN {SUPPLY_TABLE} s
-          ON sp.{SupplyPriceColumns.SOURCE_ID} = s.{SupplyColumns.ID}
-        WHERE sp.{SupplyPriceColumns.PRODUCT_ID} = %s
-          AND LOWER(s.{SupplyColumns.SOURCE_NAME}) = LOWER(%s)
-        LIMIT 1
+async def _lookup_extend_prices(product_id: int, source_name: str) -> Optional[Sequence]:
     """
-    row = db.fetch_one(sql, (product_id, source_name.strip()))
-    return int(row[0]) if row and row[0] is not None else None
+    Giá nguồn + giá cao nhất của sản phẩm trong một round-trip.
 
-
-def _lookup_highest_price(product_id: int) -> int:
-    sql = f"""
-        SELECT MAX({SupplyPriceColumns.PRICE})
-        FROM {SUPPLY_PRICE_TABLE}
-        WHERE {SupplyPriceColumns.PRODUCT_ID} = %s
+    Returns (nguon_price, highest_price); pct_ctv/pct_khach đã có sẵn trên OrderRecord.
     """
-    row = db.fetch_one(sql, (product_id,))
-    return int(row[0]) if row and row[0] else 0
+    return await db.fetch_one_async(
+        _SQL_EXTEND_PRICES,
+        {"product_id": product_id, "source_name": source_name.strip()},
+    )
 
 async def extend_order(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
     await query.answer()
     ma_don = query.data.split("|", 1)[1].strip()
 
-    matched_orders: List[OrderRecord] = context.user_data.get("matched_orders", [])
-    order = _find_order_by_ma(matched_orders, ma_don)
+    order = _find_order_by_ma(context, ma_don)
     if not order:
         await query.answer("Không tìm thấy đơn hàng trong cache.", show_alert=True)
         return await end_update(update, context)
 
     san_pham_norm = normalize_product_duration(order.san_pham)
-    match_thoi_han = re.search(r"--\s*(\d+)\s*m", san_pham_norm, flags=re.I)
-    if not match_thoi_han:
+    so_thang = _parse_duration_months(san_pham_norm)
+    if so_thang is None:
         await query.answer("Không xác định được thời hạn trong tên sản phẩm.", show_alert=True)
         return await end_update(update, context)
 
-    so_thang = int(match_thoi_han.group(1))
     so_ngay = 365 if so_thang == 12 else so_thang * 30
 
     if not order.het_han:
@@ -600,27 +762,30 @@ async def extend_order(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
         await query.answer("Không thể tính ngày hết hạn mới.", show_alert=True)
         return await end_update(update, context)
 
-    product_profile = _lookup_product_profile(order.san_pham)
+    extend_prices = (
+        await _lookup_extend_prices(order.product_id, order.nguon)
+        if order.product_id is not None
+        else None
+    )
     gia_nhap_moi = order.gia_nhap
     gia_ban_moi = order.gia_ban
 
-    if product_profile:
-        product_id, pct_ctv, pct_khach = product_profile
-        pct_ctv = Decimal(str(pct_ctv or 1))
-        pct_khach = Decimal(str(pct_khach or 1))
+    if extend_prices:
+        nguon_price, highest_price = extend_prices
+        pct_ctv = _scale_pct(order.pct_ctv)
+        pct_khach = _scale_pct(order.pct_khach)
 
-        nguon_price = _lookup_source_price(product_id, order.nguon)
         if nguon_price is not None and nguon_price > 0:
-            gia_nhap_moi = nguon_price
+            gia_nhap_moi = int(nguon_price)
 
-        highest_price = _lookup_highest_price(product_id)
+        highest_price = int(highest_price) if highest_price else 0
         if highest_price > 0:
-            high_price = Decimal(highest_price)
             ma_upper = order.ma_don.upper()
             if ma_upper.startswith("MAVC"):
-                gia_ban_moi = int(high_price * pct_ctv)
+                gia_ban_moi = highest_price * pct_ctv // _PCT_SCALE
             elif ma_upper.startswith("MAVL"):
-                gia_ban_moi = int((high_price * pct_ctv) * pct_khach)
+                # Chia một lần ở cuối để không làm tròn hai lần.
+                gia_ban_moi = highest_price * pct_ctv * pct_khach // (_PCT_SCALE * _PCT_SCALE)
             elif ma_upper.startswith("MAVK"):
                 gia_ban_moi = gia_nhap_moi
 
@@ -628,16 +793,8 @@ async def extend_order(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
     gia_ban_moi = _round_up_to_thousand(gia_ban_moi)
 
     try:
-        db.execute(
-            f"""
-            UPDATE {ORDER_LIST_TABLE}
-            SET {OrderListColumns.NGAY_DANG_KI} = %s,
-                {OrderListColumns.SO_NGAY_DA_DANG_KI} = %s,
-                {OrderListColumns.HET_HAN} = %s,
-                {OrderListColumns.GIA_NHAP} = %s,
-                {OrderListColumns.GIA_BAN} = %s
-            WHERE {OrderListColumns.ID} = %s
-            """,
+        await db.execute_async(
+            _SQL_EXTEND_ORDER,
             (
                 start_dt,
                 so_ngay,
@@ -657,6 +814,7 @@ async def extend_order(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
     order.het_han = ngay_het_han_moi
     order.gia_nhap = gia_nhap_moi
     order.gia_ban = gia_ban_moi
+    _invalidate_render(order)
 
     await query.answer("Đã gia hạn thành công.", show_alert=True)
     return await show_matched_order(update, context)
@@ -667,8 +825,7 @@ async def delete_order(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
     await query.answer("Đang Xóa...")
     ma_don_to_delete = query.data.split("|", 1)[1].strip()
 
-    matched_orders: List[OrderRecord] = context.user_data.get("matched_orders", [])
-    order = _find_order_by_ma(matched_orders, ma_don_to_delete)
+    order = _find_order_by_ma(context, ma_don_to_delete)
     if not order:
         await _edit_or_send_main_message(
             context,
@@ -678,10 +835,7 @@ async def delete_order(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
         return await end_update(update, context)
 
     try:
-        db.execute(
-            f"DELETE FROM {ORDER_LIST_TABLE} WHERE {OrderListColumns.ID} = %s",
-            (order.db_id,),
-        )
+        deleted = await db.execute_returning_async(_SQL_DELETE_ORDER, (order.db_id,))
     except Exception as exc:
         logger.error("Delete order failed: %s", exc, exc_info=True)
         await _edit_or_send_main_message(
@@ -691,8 +845,18 @@ async def delete_order(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
         )
         return await end_update(update, context)
 
-    updated = [o for o in matched_orders if o.db_id != order.db_id]
-    context.user_data["matched_orders"] = updated
+    if not deleted:
+        await _edit_or_send_main_message(
+            context,
+            update.effective_chat.id,
+            "Không Tìm Thấy Đơn Hàng.",
+        )
+        return await end_update(update, context)
+
+    deleted_ids = {row[0] for row in deleted}
+    matched_orders: List[OrderRecord] = context.user_data.get("matched_orders", [])
+    updated = [o for o in matched_orders if o.db_id not in deleted_ids]
+    _set_matched_orders(context, updated)
     if not updated:
         message = f"Đã Xóa Đơn Hàng`{escape_mdv2(ma_don_to_delete)}` Thành Công"
         await _edit_or_send_main_message(
@@ -713,24 +877,8 @@ async def start_edit_update(update: Update, context: ContextTypes.DEFAULT_TYPE)
     await query.answer()
     ma_don = query.data.split("|", 1)[1].strip()
     context.user_data["edit_ma_don"] = ma_don
-    keyboard: List[List[InlineKeyboardButton]] = []
-    for row in FIELD_MENU_LAYOUT:
-        buttons: List[InlineKeyboardButton] = []
-        for field_key in row:
-            if not field_key:
-                continue
-            cfg = FIELD_CONFIG[field_key]
-            buttons.append(
-                InlineKeyboardButton(
-                    str(cfg["label"]),
-                    callback_data=f"edit|{field_key}"
-                )
-            )
-        if buttons:
-            keyboard.append(buttons)
-    keyboard.append([InlineKeyboardButton("Quay Lại", callback_data="back_to_order")])
     await query.edit_message_text(
-        "Chọn trường muốn chỉnh sửa:", reply_markup=InlineKeyboardMarkup(keyboard)
+        "Chọn trường muốn chỉnh sửa:", reply_markup=_EDIT_FIELD_MARKUP
     )
     return EDIT_CHOOSE_FIELD
 
@@ -747,9 +895,6 @@ async def choose_field_to_edit(update: Update, context: ContextTypes.DEFAULT_TYP
     context.user_data["edit_field"] = field_key
     cfg = FIELD_CONFIG[field_key]
 
-    keyboard = [[InlineKeyboardButton("Hủy", callback_data="cancel_update")]]
-    if field_key == "LINK_KHACH":
-        keyboard.insert(0, [InlineKeyboardButton("Bỏ trống", callback_data="skip_link_khach")])
     # --- BẮT ĐẦU PHẦN THAY ĐỔI ---
     # Lưu tin nhắn prompt hiện tại để có thể chỉnh sửa sau (dành cho EDIT_INPUT_TEN_KHACH)
     _store_prompt_message(context, query.message.chat.id, query.message.message_id)
@@ -758,7 +903,7 @@ async def choose_field_to_edit(update: Update, context: ContextTypes.DEFAULT_TYP
     await query.edit_message_text(
         f"Nhập giá trị mới cho *{cfg['label']}*:",
         parse_mode="Markdown",
-        reply_markup=InlineKeyboardMarkup(keyboard),
+        reply_markup=_LINK_KHACH_MARKUP if field_key == "LINK_KHACH" else _CANCEL_MARKUP,
     )
     return cfg["state"]
 
@@ -769,14 +914,11 @@ async def back_to_order_display(
     return await show_matched_order(update, context)
 
 
-def _persist_field_change(order: OrderRecord, field_key: str, value):
+async def _persist_field_change(order: OrderRecord, field_key: str, value):
     cfg = FIELD_CONFIG[field_key]
-    column = cfg["column"]
-    db.execute(
-        f"UPDATE {ORDER_LIST_TABLE} SET {column} = %s WHERE {OrderListColumns.ID} = %s",
-        (value, order.db_id),
-    )
+    await db.execute_async(_SQL_UPDATE_FIELD[field_key], (value, order.db_id))
     setattr(order, cfg["attr"], value)
+    _invalidate_render(order)
 
 
 async def _finalize_edit(
@@ -794,7 +936,7 @@ async def _finalize_edit(
         return EDIT_INPUT_SIMPLE
     try:
         order = _get_active_order(context)
-        _persist_field_change(order, field_key, value)
+        await _persist_field_change(order, field_key, value)
     except Exception as exc:
         logger.error("Cập nhật trường %s thất bại: %s", field_key, exc, exc_info=True)
         await update.message.reply_text("Không thể cập nhật DB.")
@@ -830,13 +972,8 @@ async def input_new_nguon_handler(
     if not text:
         await update.message.reply_text("Nhập tên nguồn hợp lệ.")
         return EDIT_INPUT_NGUON
-    sql = f"""
-        SELECT 1 FROM {SUPPLY_TABLE}
-        WHERE LOWER({SupplyColumns.SOURCE_NAME}) = LOWER(%s)
-        LIMIT 1
-    """
     try:
-        exists = db.fetch_one(sql, (text,))
+        exists = await db.fetch_one_async(_SQL_SOURCE_EXISTS, (text,))
     except Exception as exc:
         logger.error("Tìm nguồn lỗi: %s", exc, exc_info=True)
         await update.message.reply_text("Không thể kiểm tra nguồn.")
@@ -872,7 +1009,7 @@ async def input_new_ten_khach_handler(
 
     try:
         order = _get_active_order(context)
-        _persist_field_change(order, "TEN_KHACH", text)
+        await _persist_field_change(order, "TEN_KHACH", text)
     except Exception as exc:
         logger.error("Cap nhat ten khach that bai: %s", exc, exc_info=True)
         await update.message.reply_text("Khong the cap nhat ten khach.")
@@ -904,18 +1041,6 @@ async def input_new_link_khach_handler(
     )
 
 
-async def skip_link_after_name_handler(
-    update: Update, context: ContextTypes.DEFAULT_TYPE
-) -> int:
-    query = update.callback_query
-    await query.answer("Bỏ Qua Liên Hệ.")
-    context.user_data.pop("after_name_link", None)
-    context.user_data["edit_field"] = "LINK_KHACH"
-    return await _finalize_edit(
-        update, context, field_key="LINK_KHACH", value="", success_notice="Đã Cập Nhật Liên Hệ"
-    )
-
-
 async def skip_link_khach_handler(
     update: Update, context: ContextTypes.DEFAULT_TYPE
 ) -> int:
@@ -962,65 +1087,75 @@ async def cancel_update(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
     return await end_update(update, context)
 
 
+async def _nav_prev(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    return await show_matched_order(update, context, "prev")
+
+
+async def _nav_next(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    return await show_matched_order(update, context, "next")
+
+
+# Pattern callback và filter nhập liệu dựng một lần khi import.
+_TEXT_INPUT = filters.TEXT & ~filters.COMMAND
+_PAT_UPDATE = re.compile("^update$")
+_PAT_MODE = re.compile("^mode_.*$")
+_PAT_CANCEL = re.compile("^cancel_update$")
+_PAT_NAV_PREV = re.compile("^nav_prev$")
+_PAT_NAV_NEXT = re.compile("^nav_next$")
+_PAT_EXTEND = re.compile(r"^action_extend\|")
+_PAT_DELETE = re.compile(r"^action_delete\|")
+_PAT_EDIT = re.compile(r"^action_edit\|")
+_PAT_EDIT_FIELD = re.compile(r"^edit\|")
+_PAT_BACK_TO_ORDER = re.compile("^back_to_order$")
+_PAT_SKIP_LINK = re.compile("^skip_link_khach$")
+_PAT_SKIP_LINK_AFTER_NAME = re.compile("^skip_link_after_name$")
+
+
 def get_update_order_conversation_handler() -> ConversationHandler:
     return ConversationHandler(
         entry_points=[
             CommandHandler("update", start_update_order),
-            CallbackQueryHandler(start_update_order, pattern="^update$"),
+            CallbackQueryHandler(start_update_order, pattern=_PAT_UPDATE),
         ],
         states={
             SELECT_MODE: [
-                CallbackQueryHandler(select_check_mode, pattern="^mode_.*$"),
+                CallbackQueryHandler(select_check_mode, pattern=_PAT_MODE),
             ],
             INPUT_VALUE: [
-                MessageHandler(filters.TEXT & ~filters.COMMAND, input_value_handler)
+                MessageHandler(_TEXT_INPUT, input_value_handler)
             ],
             SELECT_ACTION: [
-                CallbackQueryHandler(cancel_update, pattern="^cancel_update$"),
-                CallbackQueryHandler(
-                    lambda u, c: show_matched_order(u, c, "prev"),
-                    pattern="^nav_prev$",
-                ),
-                CallbackQueryHandler(
-                    lambda u, c: show_matched_order(u, c, "next"),
-                    pattern="^nav_next$",
-                ),
-                CallbackQueryHandler(extend_order, pattern=r"^action_extend\|"),
-                CallbackQueryHandler(delete_order, pattern=r"^action_delete\|"),
-                CallbackQueryHandler(start_edit_update, pattern=r"^action_edit\|"),
+                CallbackQueryHandler(cancel_update, pattern=_PAT_CANCEL),
+                CallbackQueryHandler(_nav_prev, pattern=_PAT_NAV_PREV),
+                CallbackQueryHandler(_nav_next, pattern=_PAT_NAV_NEXT),
+                CallbackQueryHandler(extend_order, pattern=_PAT_EXTEND),
+                CallbackQueryHandler(delete_order, pattern=_PAT_DELETE),
+                CallbackQueryHandler(start_edit_update, pattern=_PAT_EDIT),
             ],
             EDIT_CHOOSE_FIELD: [
-                CallbackQueryHandler(choose_field_to_edit, pattern=r"^edit\|"),
-                CallbackQueryHandler(back_to_order_display, pattern="^back_to_order$"),
+                CallbackQueryHandler(choose_field_to_edit, pattern=_PAT_EDIT_FIELD),
+                CallbackQueryHandler(back_to_order_display, pattern=_PAT_BACK_TO_ORDER),
             ],
             EDIT_INPUT_SIMPLE: [
-                MessageHandler(
-                    filters.TEXT & ~filters.COMMAND, input_new_simple_value_handler
-                )
+                MessageHandler(_TEXT_INPUT, input_new_simple_value_handler)
             ],
             EDIT_INPUT_NGUON: [
-                MessageHandler(filters.TEXT & ~filters.COMMAND, input_new_nguon_handler)
+                MessageHandler(_TEXT_INPUT, input_new_nguon_handler)
             ],
             EDIT_INPUT_SO_NGAY: [
-                MessageHandler(
-                    filters.TEXT & ~filters.COMMAND, input_new_so_ngay_handler
-                )
+                MessageHandler(_TEXT_INPUT, input_new_so_ngay_handler)
             ],
             EDIT_INPUT_TEN_KHACH: [
-                MessageHandler(
-                    filters.TEXT & ~filters.COMMAND, input_new_ten_khach_handler
-                )
+                MessageHandler(_TEXT_INPUT, input_new_ten_khach_handler)
             ],
             EDIT_INPUT_LINK_KHACH: [
-                MessageHandler(
-                    filters.TEXT & ~filters.COMMAND, input_new_link_khach_handler
-                ),
-                CallbackQueryHandler(skip_link_khach_handler, pattern="^skip_link_khach$"),
-                CallbackQueryHandler(skip_link_after_name_handler, pattern="^skip_link_after_name$"),
+                MessageHandler(_TEXT_INPUT, input_new_link_khach_handler),
+                CallbackQueryHandler(skip_link_khach_handler, pattern=_PAT_SKIP_LINK),
+                CallbackQueryHandler(skip_link_after_name_handler, pattern=_PAT_SKIP_LINK_AFTER_NAME),
             ],
         },
         fallbacks=[
-            CallbackQueryHandler(cancel_update, pattern="^cancel_update$"),
+            CallbackQueryHandler(cancel_update, pattern=_PAT_CANCEL),
             CommandHandler("cancel", cancel_update),
         ],
         name="update_order_conversation",
@@ -1,13 +1,15 @@
 from __future__ import annotations
 
+import asyncio
 import logging
+import re
+from collections import OrderedDict
 from dataclasses import dataclass
 from datetime import date, datetime
-from io import BytesIO
 from typing import Optional
 
 import requests
-from telegram import Update
+from telegram import InputMediaPhoto, Update
 from telegram.constants import ParseMode
 from telegram.error import BadRequest, NetworkError, TimedOut
 from telegram.ext import ContextTypes
@@ -40,11 +42,26 @@ logger = logging.getLogger(__name__)
 TARGET_STATUS = "Cần Gia Hạn"
 TARGET_DAYS_LEFT = 4
 MAX_DUE_ORDERS = 20
+# sendMediaGroup nhận 2-10 ảnh mỗi lần gọi, mỗi ảnh giữ caption riêng.
+MEDIA_GROUP_SIZE = 10
 QR_TEMPLATE = (
     "https://img.vietqr.io/image/VPB-mavpre-compact2.png?amount={amount}"
     "&addInfo={order_id}&accountName=NGO%20LE%20NGOC%20HUNG"
 )
 
+# HEAD thử một lần mỗi lượt job: nếu img.vietqr.io không phản hồi thì gửi text
+# cho mọi đơn thay vì để Telegram chờ timeout khi tải từng URL QR.
+QR_PROBE_URL = QR_TEMPLATE.format(amount=1, order_id="probe")
+QR_PROBE_TIMEOUT = 2  # giây
+
+_ISO_DATE_RE = re.compile(r"(\d{4})-(\d{2})-(\d{2})$")
+_VN_DATE_RE = re.compile(r"(\d{2})/(\d{2})/(\d{4})$")
+
+# URL QR -> file_id Telegram (LRU). Lần chạy job sau với cùng (số tiền, mã đơn)
+# gửi lại bằng file_id nên Telegram không phải tải ảnh từ img.vietqr.io nữa.
+QR_CACHE_SIZE = 256
+_QR_FILE_IDS: "OrderedDict[str, str]" = OrderedDict()
+
 
 @dataclass
 class DueOrder:
@@ -67,100 +84,140 @@ class DueOrder:
 def _coerce_date(value) -> Optional[date]:
     if value is None:
         return None
-    if isinstance(value, date):
-        return value
+    # datetime là lớp con của date nên phải kiểm tra trước.
     if isinstance(value, datetime):
         return value.date()
+    if isinstance(value, date):
+        return value
+    text = str(value)
+    match = _ISO_DATE_RE.match(text)
+    try:
+        if match:
+            year, month, day = match.groups()
+            return date(int(year), int(month), int(day))
+        match = _VN_DATE_RE.match(text)
+        if match:
+            day, month, year = match.groups()
+            return date(int(year), int(month), int(day))
+    except ValueError:
+        return None
+    # Dạng không đệm số 0 (vd 2/1/2025) vẫn đi qua strptime như trước.
     for fmt in ("%Y-%m-%d", "%d/%m/%Y"):
         try:
-            return datetime.strptime(str(value), fmt).date()
+            return datetime.strptime(text, fmt).date()
         except ValueError:
             continue
     return None
 
 
+# Câu SQL cố định — dựng một lần khi import
+_SUPPLY_MIN_PRICE_SQL = (
+    f"SELECT {SupplyPriceColumns.PRODUCT_ID} AS product_id,"
+    f" MIN({SupplyPriceColumns.PRICE}) AS price"
+    f" FROM {SUPPLY_PRICE_TABLE}"
+    f" GROUP BY {SupplyPriceColumns.PRODUCT_ID}"
+)
+
+def _trimmed(column: str) -> str:
+    # Cột văn bản được làm sạch ngay trong SQL: Python nhận chuỗi đã TRIM, không có NULL.
+    return f"TRIM(COALESCE(ol.{column}::text, ''))"
+
+
+# psycopg2 chèn tham số phía client nên Postgres thấy TARGET_STATUS dạng literal
+# và khớp được partial index idx_order_list_due_het_han (migration 004).
+_DUE_ORDERS_SQL = f"""
+    SELECT
+        ol.{OrderListColumns.ID},
+        {_trimmed(OrderListColumns.ID_DON_HANG)},
+        {_trimmed(OrderListColumns.SAN_PHAM)},
+        {_trimmed(OrderListColumns.THONG_TIN_SAN_PHAM)},
+        {_trimmed(OrderListColumns.KHACH_HANG)},
+        {_trimmed(OrderListColumns.LINK_LIEN_HE)},
+        {_trimmed(OrderListColumns.SLOT)},
+        ol.{OrderListColumns.NGAY_DANG_KI},
+        ol.{OrderListColumns.SO_NGAY_DA_DANG_KI},
+        ol.{OrderListColumns.HET_HAN},
+        {_trimmed(OrderListColumns.NGUON)},
+        {_trimmed(OrderListColumns.NOTE)},
+        COALESCE(ol.{OrderListColumns.GIA_BAN}, spp.price, 0) AS price_vnd,
+        ol.{OrderListColumns.HET_HAN}::date - CURRENT_DATE AS days_left
+    FROM {ORDER_LIST_TABLE} AS ol
+    LEFT JOIN {SUPPLY_TABLE} AS s
+        ON LOWER(s.{SupplyColumns.SOURCE_NAME}) = LOWER(ol.{OrderListColumns.NGUON})
+    LEFT JOIN {PRODUCT_PRICE_TABLE} AS pp
+        ON LOWER(pp.{ProductPriceColumns.SAN_PHAM}) = LOWER(ol.{OrderListColumns.SAN_PHAM})
+    LEFT JOIN ({_SUPPLY_MIN_PRICE_SQL}) AS spp
+        ON spp.product_id = pp.{ProductPriceColumns.ID}
+    WHERE LOWER(ol.{OrderListColumns.TINH_TRANG}) = LOWER(%s)
+      AND ol.{OrderListColumns.HET_HAN}::date - CURRENT_DATE = %s
+    ORDER BY ol.{OrderListColumns.HET_HAN} ASC
+    LIMIT %s
+"""
+
+
+# Thăm dò rẻ (chỉ order_list, dùng partial index het_han) trước khi chạy câu JOIN đầy đủ.
+_HAS_DUE_SQL = f"""
+    SELECT 1
+    FROM {ORDER_LIST_TABLE}
+    WHERE LOWER({OrderListColumns.TINH_TRANG}) = LOWER(%s)
+      AND {OrderListColumns.HET_HAN}::date - CURRENT_DATE = %s
+    LIMIT 1
+"""
+
+
+def _has_any_due() -> bool:
+    return db.fetch_one(_HAS_DUE_SQL, (TARGET_STATUS, TARGET_DAYS_LEFT)) is not None
+
+
+def _fetch_due_orders_if_any() -> list[DueOrder]:
+    if not _has_any_due():
+        return []
+    return fetch_due_orders()
+
+
+def _row_to_order(row) -> DueOrder:
+    (
+        db_id,
+        order_code,
+        product,
+        description,
+        customer,
+        customer_link,
+        slot,
+        start_date,
+        duration_days,
+        expiry_date,
+        source,
+        note,
+        price_vnd,
+        days_left,
+    ) = row
+    return DueOrder(
+        db_id=int(db_id),
+        order_code=order_code,
+        product_name=product,
+        description=description,
+        customer_name=customer,
+        customer_link=customer_link,
+        slot=slot,
+        start_date=_coerce_date(start_date),
+        duration_days=int(duration_days) if duration_days else None,
+        expiry_date=_coerce_date(expiry_date),
+        source=source,
+        note=note,
+        sale_price=int(price_vnd or 0),
+        days_left=int(days_left),
+    )
+
+
 def fetch_due_orders(limit: int = MAX_DUE_ORDERS) -> list[DueOrder]:
     """
     Query PostgreSQL to find orders that need extension.
     Requirement: order_list.tinh_trang indicates "Cần Gia Hạn"
     and remaining days equal TARGET_DAYS_LEFT.
     """
-
-    supply_price_subquery = (
-        f"SELECT {SupplyPriceColumns.PRODUCT_ID} AS product_id,"
-        f" MIN({SupplyPriceColumns.PRICE}) AS price"
-        f" FROM {SUPPLY_PRICE_TABLE}"
-        f" GROUP BY {SupplyPriceColumns.PRODUCT_ID}"
-    )
-
-    sql = f"""
-        SELECT
-            ol.{OrderListColumns.ID},
-            ol.{OrderListColumns.ID_DON_HANG},
-            ol.{OrderListColumns.SAN_PHAM},
-            ol.{OrderListColumns.THONG_TIN_SAN_PHAM},
-            ol.{OrderListColumns.KHACH_HANG},
-            ol.{OrderListColumns.LINK_LIEN_HE},
-            ol.{OrderListColumns.SLOT},
-            ol.{OrderListColumns.NGAY_DANG_KI},
-            ol.{OrderListColumns.SO_NGAY_DA_DANG_KI},
-            ol.{OrderListColumns.HET_HAN},
-            ol.{OrderListColumns.NGUON},
-            ol.{OrderListColumns.NOTE},
-            COALESCE(ol.{OrderListColumns.GIA_BAN}, spp.price, 0) AS price_vnd
-        FROM {ORDER_LIST_TABLE} AS ol
-        LEFT JOIN {SUPPLY_TABLE} AS s
-            ON LOWER(s.{SupplyColumns.SOURCE_NAME}) = LOWER(ol.{OrderListColumns.NGUON})
-        LEFT JOIN {PRODUCT_PRICE_TABLE} AS pp
-            ON LOWER(pp.{ProductPriceColumns.SAN_PHAM}) = LOWER(ol.{OrderListColumns.SAN_PHAM})
-        LEFT JOIN ({supply_price_subquery}) AS spp
-            ON spp.product_id = pp.{ProductPriceColumns.ID}
-        WHERE LOWER(ol.{OrderListColumns.TINH_TRANG}) = LOWER(%s)
-        ORDER BY ol.{OrderListColumns.HET_HAN} ASC
-        LIMIT %s
-    """
-    rows = db.fetch_all(sql, (TARGET_STATUS, limit))
-    due_orders: list[DueOrder] = []
-    today = date.today()
-    for row in rows:
-        (
-            db_id,
-            order_code,
-            product,
-            description,
-            customer,
-            customer_link,
-            slot,
-            start_date,
-            duration_days,
-            expiry_date,
-            source,
-            note,
-            price_vnd,
-        ) = row
-        expiry = _coerce_date(expiry_date)
-        days_left = (expiry - today).days if expiry else 0
-        if days_left != TARGET_DAYS_LEFT:
-            continue
-        due_orders.append(
-            DueOrder(
-                db_id=int(db_id),
-                order_code=str(order_code or "").strip(),
-                product_name=str(product or "").strip(),
-                description=str(description or "").strip(),
-                customer_name=str(customer or "").strip(),
-                customer_link=str(customer_link or "").strip(),
-                slot=str(slot or "").strip(),
-                start_date=_coerce_date(start_date),
-                duration_days=int(duration_days) if duration_days else None,
-                expiry_date=_coerce_date(expiry_date),
-                source=str(source or "").strip(),
-                note=str(note or "").strip(),
-                sale_price=int(price_vnd or 0),
-                days_left=int(days_left),
-            )
-        )
-    return due_orders
+    rows = db.fetch_all(_DUE_ORDERS_SQL, (TARGET_STATUS, TARGET_DAYS_LEFT, limit))
+    return [_row_to_order(row) for row in rows]
 
 
 def _format_currency(value: int) -> str:
@@ -173,7 +230,41 @@ def _clean(text: str | None) -> str:
     return str(text or "").strip()
 
 
-def _build_caption(order: DueOrder, index: int, total: int) -> tuple[str, Optional[BytesIO]]:
+def _qr_url(order: DueOrder) -> Optional[str]:
+    """URL ảnh QR thanh toán cho đơn; None khi đơn chưa có giá."""
+    if order.sale_price <= 0:
+        return None
+    return QR_TEMPLATE.format(amount=order.sale_price, order_id=order.order_code)
+
+
+def _qr_service_up() -> bool:
+    try:
+        response = requests.head(QR_PROBE_URL, timeout=QR_PROBE_TIMEOUT, allow_redirects=True)
+    except requests.RequestException as exc:
+        logger.warning("QR service probe failed: %s", exc)
+        return False
+    return response.status_code < 500
+
+
+def _cached_qr_photo(qr_url: str) -> str:
+    """file_id Telegram đã lưu cho URL này (nếu có), ngược lại chính URL đó."""
+    file_id = _QR_FILE_IDS.get(qr_url)
+    if file_id is None:
+        return qr_url
+    _QR_FILE_IDS.move_to_end(qr_url)
+    return file_id
+
+
+def _remember_qr_photo(qr_url: str, message) -> None:
+    if not message or not message.photo:
+        return
+    _QR_FILE_IDS[qr_url] = message.photo[-1].file_id
+    _QR_FILE_IDS.move_to_end(qr_url)
+    while len(_QR_FILE_IDS) > QR_CACHE_SIZE:
+        _QR_FILE_IDS.popitem(last=False)
+
+
+def _build_caption(order: DueOrder, index: int, total: int) -> str:
     header = (
         f"Đơn Cần Gia Hạn ({index + 1}/{total})\n"
         f"Mã Đơn: { _clean(order.order_code)}\n"
@@ -214,71 +305,57 @@ def _build_caption(order: DueOrder, index: int, total: int) -> tuple[str, Option
         f"Xin cám ơn!"
     )
 
-    qr_image = None
-    if order.sale_price > 0:
-        try:
-            qr_url = QR_TEMPLATE.format(amount=order.sale_price, order_id=order.order_code)
-            response = requests.get(qr_url, timeout=10)
-            response.raise_for_status()
-            qr_image = BytesIO(response.content)
-        except requests.RequestException as exc:
-            logger.warning("Failed generating QR for %s: %s", order.order_code, exc)
+    return caption
 
-    return caption, qr_image
+
+# Các khối cố định của caption — dựng một lần khi import.
+_SECTION_PRODUCT = "──────🧾 THÔNG TIN SẢN PHẨM ──────"
+_SECTION_CUSTOMER = "──────🤝 THÔNG TIN KHÁCH HÀNG ──────"
+_PAYMENT_BLOCK = (
+    "──────ℹ️ THÔNG TIN THANH TOÁN ──────\n"
+    "\n"
+    "🏦 Ngân hàng: VP Bank\n"
+    "🏧 STK: 9183400998\n"
+    "👤 Tên: NGO LE NGOC HUNG"
+)
+_CAPTION_FOOTER = (
+    "\n\n"
+    "⚠️ Vui lòng ghi đúng mã đơn trong nội dung chuyển khoản để xử lý nhanh.\n"
+    "🙏 Trân trọng cảm ơn quý khách!"
+)
 
 
-def _build_caption_pretty(order: DueOrder, index: int, total: int) -> tuple[str, Optional[BytesIO]]:
+def _build_caption_pretty(order: DueOrder, index: int, total: int) -> str:
     """
     Build a cleaner, plain-text caption for due-order notifications.
     ASCII separators only (parse_mode=None) to avoid Markdown issues.
+    Text fields arrive trimmed from fetch_due_orders, so they are used as-is.
     """
-    lines: list[str] = []
-    lines.append(f"📦 Đơn hàng đến hạn ({index + 1}/{total})")
-    lines.append(f"🧰 Sản phẩm: {_clean(order.product_name)}")
-    lines.append(f"🆔 Mã đơn: {_clean(order.order_code)}")
-    lines.append(f"⏳ Còn lại: {order.days_left} ngày")
-
-    lines.append("──────🧾 THÔNG TIN SẢN PHẨM ──────")
-    if order.description:
-        lines.append(f"📝 Mô tả: {_clean(order.description)}")
-    if order.slot:
-        lines.append(f"📌 Slot: {_clean(order.slot)}")
-    if order.start_date:
-        lines.append(f"📅 Ngày đăng ký: {_clean(order.start_date.strftime('%d/%m/%Y'))}")
-    if order.duration_days:
-        lines.append(f"⏱️ Thời hạn: {order.duration_days} ngày")
-    if order.expiry_date:
-        lines.append(f"📆 Ngày hết hạn: {_clean(order.expiry_date.strftime('%d/%m/%Y'))}")
-    lines.append(f"💰 Giá bán: {_format_currency(order.sale_price)}")
-
-    lines.append("──────🤝 THÔNG TIN KHÁCH HÀNG ──────")
-    lines.append(f"👥 Tên: {_clean(order.customer_name or '---')}")
-    if order.customer_link:
-        lines.append(f"🔗 Liên hệ: {_clean(order.customer_link)}")
-
-    lines.append("──────ℹ️ THÔNG TIN THANH TOÁN ──────")
-    lines.append("")
-    lines.append("🏦 Ngân hàng: VP Bank")
-    lines.append("🏧 STK: 9183400998")
-    lines.append("👤 Tên: NGO LE NGOC HUNG")
-    lines.append(f"🧾 Nội dung: Thanh toán {_clean(order.order_code)}")
-
-    lines.append("")
-    lines.append("⚠️ Vui lòng ghi đúng mã đơn trong nội dung chuyển khoản để xử lý nhanh.")
-    lines.append("🙏 Trân trọng cảm ơn quý khách!")
-    caption = "\n".join(lines)
-
-    qr_image = None
-    if order.sale_price > 0:
-        try:
-            qr_url = QR_TEMPLATE.format(amount=order.sale_price, order_id=order.order_code)
-            response = requests.get(qr_url, timeout=10)
-            response.raise_for_status()
-            qr_image = BytesIO(response.content)
-        except requests.RequestException as exc:
-            logger.warning("Failed generating QR for %s: %s", order.order_code, exc)
-
-    return caption, qr_image
+    details = "".join(
+        line
+        for line in (
+            order.description and f"\n📝 Mô tả: {order.description}",
+            order.slot and f"\n📌 Slot: {order.slot}",
+            order.start_date and f"\n📅 Ngày đăng ký: {order.start_date:%d/%m/%Y}",
+            order.duration_days and f"\n⏱️ Thời hạn: {order.duration_days} ngày",
+            order.expiry_date and f"\n📆 Ngày hết hạn: {order.expiry_date:%d/%m/%Y}",
+        )
+        if line
+    )
+    link = f"\n🔗 Liên hệ: {order.customer_link}" if order.customer_link else ""
+    return (
+        f"📦 Đơn hàng đến hạn ({index + 1}/{total})\n"
+        f"🧰 Sản phẩm: {order.product_name}\n"
+        f"🆔 Mã đơn: {order.order_code}\n"
+        f"⏳ Còn lại: {order.days_left} ngày\n"
+        f"{_SECTION_PRODUCT}{details}\n"
+        f"💰 Giá bán: {_format_currency(order.sale_price)}\n"
+        f"{_SECTION_CUSTOMER}\n"
+        f"👥 Tên: {order.customer_name or '---'}{link}\n"
+        f"{_PAYMENT_BLOCK}\n"
+        f"🧾 Nội dung: Thanh toán {order.order_code}"
+        f"{_CAPTION_FOOTER}"
+    )
 
 
 async def check_due_orders_job(context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -287,7 +364,9 @@ async def check_due_orders_job(context: ContextTypes.DEFAULT_TYPE) -> None:
         logger.info("SEND_DUE_ORDER_TO_TOPIC is disabled; skipping notification job.")
         return
     try:
-        orders = fetch_due_orders()
+        # psycopg2 chặn (blocking): chạy trên executor của db để event loop
+        # vẫn xử lý các update Telegram khác trong lúc job chạy.
+        orders = await db.run_async(_fetch_due_orders_if_any)
     except Exception as exc:
         logger.error("Failed to query due orders: %s", exc, exc_info=True)
         if SEND_ERROR_TO_TOPIC and ERROR_GROUP_ID and ERROR_TOPIC_ID is not None:
@@ -332,30 +411,93 @@ async def check_due_orders_job(context: ContextTypes.DEFAULT_TYPE) -> None:
     except Exception as exc:
         logger.warning("Failed sending header message: %s", exc)
 
-    for index, order in enumerate(orders):
-        caption, qr_image = _build_caption_pretty(order, index, len(orders))
+    # Chỉ cần thăm dò khi còn đơn phải để Telegram tải QR từ URL (chưa có file_id).
+    qr_disabled = False
+    if any(url and url not in _QR_FILE_IDS for url in map(_qr_url, orders)):
+        qr_disabled = not await asyncio.to_thread(_qr_service_up)
+        if qr_disabled:
+            logger.warning("QR service unavailable; sending due orders without QR images.")
+
+    total = len(orders)
+
+    async def _send_text(caption: str) -> None:
+        await context.bot.send_message(
+            chat_id=group_id,
+            message_thread_id=topic_id,
+            text=caption,
+            parse_mode=None,
+        )
+
+    async def _send_one(order: DueOrder, caption: str, qr_url: Optional[str], photo: Optional[str]) -> None:
         try:
-            if qr_image:
-                qr_image.seek(0)
-                await context.bot.send_photo(
-                    chat_id=group_id,
-                    message_thread_id=topic_id,
-                    photo=qr_image,
-                    caption=caption,
-                    parse_mode=None,
-                )
+            if photo:
+                # Telegram tự tải ảnh từ URL: bot không phải tải QR về rồi upload lại.
+                try:
+                    sent = await context.bot.send_photo(
+                        chat_id=group_id,
+                        message_thread_id=topic_id,
+                        photo=photo,
+                        caption=caption,
+                        parse_mode=None,
+                    )
+                    _remember_qr_photo(qr_url, sent)
+                except BadRequest as exc:
+                    logger.warning("Failed generating QR for %s: %s", order.order_code, exc)
+                    await _send_text(caption)
             else:
-                await context.bot.send_message(
-                    chat_id=group_id,
-                    message_thread_id=topic_id,
-                    text=caption,
-                    parse_mode=None,
-                )
+                await _send_text(caption)
         except BadRequest as exc:
             logger.error("Failed sending order %s: %s", order.order_code, exc)
         except Exception as exc:
             logger.error("Unexpected error sending order %s: %s", order.order_code, exc, exc_info=True)
 
+    async def _send_album(chunk: list) -> None:
+        media = [InputMediaPhoto(media=photo, caption=caption) for _, caption, _, photo in chunk]
+        try:
+            sent = await context.bot.send_media_group(
+                chat_id=group_id,
+                message_thread_id=topic_id,
+                media=media,
+            )
+        except BadRequest as exc:
+            # Một URL QR hỏng làm hỏng cả album: gửi lại từng đơn để các đơn khác vẫn có ảnh.
+            logger.warning("Failed sending QR album, falling back to single messages: %s", exc)
+            for item in chunk:
+                await _send_one(*item)
+            return
+        except Exception as exc:
+            logger.error("Unexpected error sending QR album: %s", exc, exc_info=True)
+            return
+        for (_, _, qr_url, _), message in zip(chunk, sent):
+            _remember_qr_photo(qr_url, message)
+
+    # Gửi tuần tự theo thứ tự (i/N): các đơn có ảnh liền nhau gom thành album,
+    # đơn chỉ có text được gửi ngay tại vị trí của nó.
+    pending_photos: list = []
+
+    async def _flush_photos() -> None:
+        for start in range(0, len(pending_photos), MEDIA_GROUP_SIZE):
+            chunk = pending_photos[start:start + MEDIA_GROUP_SIZE]
+            if len(chunk) > 1:
+                await _send_album(chunk)
+            else:
+                await _send_one(*chunk[0])
+        pending_photos.clear()
+
+    for index, order in enumerate(orders):
+        caption = _build_caption_pretty(order, index, total)
+        qr_url = _qr_url(order)
+        photo = _cached_qr_photo(qr_url) if qr_url else None
+        if qr_disabled and photo == qr_url:
+            photo = None
+        if photo:
+            pending_photos.append((order, caption, qr_url, photo))
+        else:
+            await _flush_photos()
+            await _send_one(order, caption, None, None)
+
+    await _flush_photos()
+
 
 def _format_due_orders_console(orders: list[DueOrder]) -> str:
     parts = []
@@ -2,6 +2,7 @@ from __future__ import annotations
 
 import asyncio
 import logging
+from functools import lru_cache
 from typing import Any, Mapping
 
 from telegram import Bot
@@ -10,6 +11,7 @@ from telegram.error import NetworkError, RetryAfter, TimedOut
 
 from mavrykbot.core.config import load_topic_config
 from mavrykbot.core.utils import escape_mdv2
+from mavrykbot.notifications._common import format_currency_mdv2, parse_topic_id
 
 __all__ = ["send_renewal_success_notification", "send_renewal_status_notification"]
 
@@ -18,33 +20,75 @@ logger = logging.getLogger(__name__)
 DEFAULT_NOTIFICATION_GROUP_ID = "-1002934465528"
 DEFAULT_RENEWAL_TOPIC_ID = 2
 
-TOPIC_CONFIG = load_topic_config()
-
 
 def _resolve_target(chat_id: str | None, topic_id: int | None) -> tuple[str | None, int | None]:
-    resolved_chat = chat_id or TOPIC_CONFIG.renewal_group_id or DEFAULT_NOTIFICATION_GROUP_ID
-    topic_source = topic_id if topic_id is not None else (TOPIC_CONFIG.renewal_topic_id or DEFAULT_RENEWAL_TOPIC_ID)
-    try:
-        resolved_topic = int(topic_source)
-    except (TypeError, ValueError):
-        resolved_topic = None
-    return resolved_chat, resolved_topic
+    cfg = load_topic_config()
+    resolved_chat = chat_id or cfg.renewal_group_id or DEFAULT_NOTIFICATION_GROUP_ID
+    topic_source = topic_id if topic_id is not None else (cfg.renewal_topic_id or DEFAULT_RENEWAL_TOPIC_ID)
+    return resolved_chat, parse_topic_id(topic_source)
 
 
-def _format_currency(value: Any) -> str:
-    """Format arbitrary numeric input into a readable currency string."""
-    try:
-        number = float(str(value).replace(",", "").strip())
-    except (ValueError, TypeError):
-        return "0"
-    return "{:,.0f}".format(number)
+def _resolve_error_target(chat_id: str | None, topic_id: int | None) -> tuple[str | None, int | None]:
+    cfg = load_topic_config()
+    resolved_chat = chat_id or cfg.error_group_id or cfg.renewal_group_id
+    topic_source = topic_id if topic_id is not None else (
+        cfg.error_topic_id if cfg.error_topic_id is not None else cfg.renewal_topic_id
+    )
+    return resolved_chat, parse_topic_id(topic_source)
+
+
+# Khung tin nhắn gia hạn thành công — chỉ các trường biến đổi được escape rồi
+# điền vào bằng format_map. {slot_line} là "" hoặc "\n🎟️ *Slot:* ...".
+_SUCCESS_TEMPLATE = "\n".join(
+    [
+        "✅ *GIA HẠN TỰ ĐỘNG THÀNH CÔNG*",
+        "┏━━━ *Thông Tin Đơn Hàng* ━━━┓",
+        "🆔 *Mã Đơn:* `{ma_don_hang}`",
+        "📦 *Sản Phẩm:* {san_pham}",
+        "📧 *Thông tin:* {thong_tin_don}{slot_line}",
+        "📅 *Ngày Đăng Ký:* {ngay_dang_ky}",
+        "⏰ *Hết Hạn:* *{ngay_het_han}*",
+        "💰 *Giá Bán:* {gia_ban}d",
+        "",
+        "┗━━━ *Thông Tin Nhà Cung Cấp* ━━━┛",
+        "🏷️ *Nhà Cung Cấp:* {nguon}",
+        "💵 *Giá Nhập:* {gia_nhap}d",
+    ]
+)
+
+@lru_cache(maxsize=2048)
+def _esc_cached(text: str) -> str:
+    return escape_mdv2(text)
+
+
+def _esc(value: Any) -> str:
+    """escape_mdv2 có nhớ: sản phẩm, nguồn, ngày lặp lại giữa các đơn nên phần lớn là cache hit."""
+    return "" if value is None else _esc_cached(str(value))
 
 
-def _build_slot_section(order_details: Mapping[str, Any]) -> str:
+_SUCCESS_FIELDS = {
+    "ma_don_hang": "ID_DON_HANG",
+    "san_pham": "SAN_PHAM",
+    "thong_tin_don": "THONG_TIN_DON",
+    "ngay_dang_ky": "NGAY_DANG_KY",
+    "ngay_het_han": "HET_HAN",
+    "nguon": "NGUON",
+}
+
+
+def _build_success_message(order_details: Mapping[str, Any]) -> str:
+    values = {
+        name: _esc(order_details.get(key)) for name, key in _SUCCESS_FIELDS.items()
+    }
+    values["gia_ban"] = format_currency_mdv2(order_details.get("GIA_BAN"))
+    values["gia_nhap"] = format_currency_mdv2(order_details.get("GIA_NHAP"))
     slot_data = order_details.get("SLOT")
-    if slot_data and str(slot_data).strip():
-        return f"🎟️ *Slot:* {escape_mdv2(slot_data)}"
-    return ""
+    values["slot_line"] = (
+        f"\n🎟️ *Slot:* {_esc(slot_data)}"
+        if slot_data and str(slot_data).strip()
+        else ""
+    )
+    return _SUCCESS_TEMPLATE.format_map(values)
 
 
 async def send_renewal_success_notification(
@@ -70,7 +114,7 @@ async def send_renewal_success_notification(
         logger.warning("send_renewal_success_notification was called without order details.")
         return
 
-    if not TOPIC_CONFIG.send_renewal_to_topic:
+    if not load_topic_config().send_renewal_to_topic:
         logger.info("Skipping renewal notification because SEND_RENEWAL_TO_TOPIC is disabled in config.")
         return
 
@@ -80,40 +124,7 @@ async def send_renewal_success_notification(
         return
 
     try:
-        ma_don_hang = escape_mdv2(order_details.get("ID_DON_HANG"))
-        san_pham = escape_mdv2(order_details.get("SAN_PHAM"))
-        thong_tin_don = escape_mdv2(order_details.get("THONG_TIN_DON"))
-        ngay_dang_ky = escape_mdv2(order_details.get("NGAY_DANG_KY"))
-        ngay_het_han = escape_mdv2(order_details.get("HET_HAN"))
-        nguon = escape_mdv2(order_details.get("NGUON"))
-
-        gia_nhap = _format_currency(order_details.get("GIA_NHAP"))
-        gia_ban = _format_currency(order_details.get("GIA_BAN"))
-
-        slot_line = _build_slot_section(order_details)
-
-        lines = [
-            "✅ *GIA HẠN TỰ ĐỘNG THÀNH CÔNG*",
-            "┏━━━ *Thông Tin Đơn Hàng* ━━━┓",
-            f"🆔 *Mã Đơn:* `{ma_don_hang}`",
-            f"📦 *Sản Phẩm:* {san_pham}",
-            f"📧 *Thông tin:* {thong_tin_don}",
-        ]
-        if slot_line:
-            lines.append(slot_line)
-        lines.extend(
-            [
-                f"📅 *Ngày Đăng Ký:* {ngay_dang_ky}",
-                f"⏰ *Hết Hạn:* *{ngay_het_han}*",
-                f"💰 *Giá Bán:* {escape_mdv2(gia_ban)}d",
-                "",
-                "┗━━━ *Thông Tin Nhà Cung Cấp* ━━━┛",
-                f"🏷️ *Nhà Cung Cấp:* {nguon}",
-                f"💵 *Giá Nhập:* {escape_mdv2(gia_nhap)}d",
-            ]
-        )
-
-        message = "\n".join(lines)
+        message = _build_success_message(order_details)
 
         await bot.send_message(
             chat_id=target_chat_id,
@@ -148,7 +159,8 @@ async def send_renewal_status_notification(
     Send a short summary of the renewal status (success/skip/error) to the renewal topic.
     Useful when Sepay payment webhook handles an order but renewal logic does not run.
     """
-    if not TOPIC_CONFIG.send_error_to_topic and not TOPIC_CONFIG.send_renewal_to_topic:
+    cfg = load_topic_config()
+    if not cfg.send_error_to_topic and not cfg.send_renewal_to_topic:
         return
 
     target_chat_id, target_topic_id = _resolve_error_target(target_chat_id, target_topic_id)
@@ -191,14 +203,3 @@ async def send_renewal_status_notification(
                 exc_info=True,
             )
             return
-
-def _resolve_error_target(chat_id: str | None, topic_id: int | None) -> tuple[str | None, int | None]:
-    resolved_chat = chat_id or TOPIC_CONFIG.error_group_id or TOPIC_CONFIG.renewal_group_id
-    topic_source = topic_id if topic_id is not None else (
-        TOPIC_CONFIG.error_topic_id if TOPIC_CONFIG.error_topic_id is not None else TOPIC_CONFIG.renewal_topic_id
-    )
-    try:
-        resolved_topic = int(topic_source) if topic_source is not None else None
-    except (TypeError, ValueError):
-        resolved_topic = None
-    return resolved_chat, resolved_topic
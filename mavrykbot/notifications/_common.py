@@ -0,0 +1,29 @@
+"""Helpers shared by the Telegram notifiers in this package."""
+from __future__ import annotations
+
+from typing import Any
+
+
+def format_currency(value: Any) -> str:
+    """Format arbitrary numeric input into a readable currency string."""
+    try:
+        number = float(str(value).replace(",", "").strip())
+    except (ValueError, TypeError):
+        return "0"
+    return "{:,.0f}".format(number)
+
+
+def format_currency_mdv2(value: Any) -> str:
+    """format_currency ready for MarkdownV2: digits and commas need no escaping, only a leading minus."""
+    text = format_currency(value)
+    return "\\" + text if text.startswith("-") else text
+
+
+def parse_topic_id(value: Any) -> int | None:
+    """Topic id from config/override as int; None when missing or not numeric."""
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
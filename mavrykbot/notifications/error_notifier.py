@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import logging
+import time
 import traceback
 from typing import Any
 
@@ -12,7 +13,26 @@ from mavrykbot.core.config import load_topic_config
 from mavrykbot.core.utils import escape_mdv2
 
 logger = logging.getLogger(__name__)
-TOPIC_CONFIG = load_topic_config()
+
+# Cùng một lỗi (message + loại + nội dung exception) chỉ báo một lần trong cửa sổ này:
+# khi sự cố kéo dài, mỗi job/handler lỗi lại không bắn thêm một tin giống hệt vào topic.
+ERROR_DEDUP_WINDOW = 60  # giây
+_recent_errors: dict[tuple, float] = {}
+
+
+def _dedup_key(message: str, exception: BaseException | None) -> tuple:
+    return (message, type(exception), str(exception) if exception is not None else None)
+
+
+def _seen_recently(key: tuple) -> bool:
+    now = time.monotonic()
+    # dict giữ thứ tự chèn = thứ tự thời gian, nên chỉ cần cắt các mục cũ ở đầu.
+    while _recent_errors:
+        oldest_key, sent_at = next(iter(_recent_errors.items()))
+        if now - sent_at < ERROR_DEDUP_WINDOW:
+            break
+        del _recent_errors[oldest_key]
+    return key in _recent_errors
 
 
 async def notify_error(bot: Bot, message: str, *, exception: Exception | BaseException | None = None, extra: dict[str, Any] | None = None) -> None:
@@ -30,15 +50,21 @@ async def notify_error(bot: Bot, message: str, *, exception: Exception | BaseExc
     extra:
         Optional dictionary of extra context that will be rendered as key/value pairs.
     """
-    if not TOPIC_CONFIG.send_error_to_topic:
+    cfg = load_topic_config()
+    if not cfg.send_error_to_topic:
         return
 
-    chat_id = TOPIC_CONFIG.error_group_id
-    topic_id = TOPIC_CONFIG.error_topic_id
+    chat_id = cfg.error_group_id
+    topic_id = cfg.error_topic_id
     if not chat_id or topic_id is None:
         logger.warning("Error notification skipped due to missing chat/topic configuration.")
         return
 
+    dedup_key = _dedup_key(message, exception)
+    if _seen_recently(dedup_key):
+        logger.info("Suppressed duplicate error notification: %s", message)
+        return
+
     body_lines_md = [f"*BOT LỖI:* {escape_mdv2(message)}"]
     body_lines_plain = [f"BOT LỖI: {message}"]
 
@@ -79,8 +105,12 @@ async def notify_error(bot: Bot, message: str, *, exception: Exception | BaseExc
             message_thread_id=topic_id,
             text=text_plain,
         )
+        _recent_errors[dedup_key] = time.monotonic()
     except (RetryAfter, TimedOut, NetworkError) as exc:
         logger.error("Temporary error while sending notification: %s", exc, exc_info=True)
         raise
     except Exception as exc:  # pragma: no cover - defensive logging
         logger.error("Failed to deliver error notification: %s", exc, exc_info=True)
+    else:
+        # Chỉ ghi nhận sau khi gửi được, để lần báo lỗi sau vẫn thử lại nếu lần này thất bại.
+        _recent_errors[dedup_key] = time.monotonic()
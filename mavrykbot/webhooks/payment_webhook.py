@@ -1,10 +1,13 @@
 from __future__ import annotations
 
 import asyncio
+import atexit
+import concurrent.futures
 import logging
 import os
 import re
 import threading
+import time
 import unicodedata
 from datetime import datetime, date
 from typing import Iterable, Mapping, Tuple, Optional
@@ -28,7 +31,7 @@ from mavrykbot.core.db_schema import (
     SUPPLY_TABLE,
     SupplyColumns,
 )
-from mavrykbot.handlers.renewal_logic import run_renewal
+from mavrykbot.handlers.renewal_logic import run_renewal_bulk
 from mavrykbot.notifications.Notify_RenewOrder import (
     send_renewal_status_notification,
     send_renewal_success_notification,
@@ -45,26 +48,141 @@ PAYMENT_WEBHOOK_PATH = f"/bot/payment_sepay/{PAYMENT_WEBHOOK_SECRET}"
 
 payment_webhook_blueprint = Blueprint("payment_webhook", __name__)
 
-_bot_instance: Bot | None = None
+_MA_DON_RE = re.compile(r"MAV\w{5,}")
+_AMOUNT_CHARS_RE = re.compile(r"[^\d.,-]")
+_SIGNED_DIGITS_RE = re.compile(r"[^\d-]")
+_DIGITS_RE = re.compile(r"[^\d]")
+
+# Worker cố định xử lý payload thay cho một thread mới mỗi request. Khi số payload
+# đang chờ/đang chạy vượt PAYMENT_MAX_PENDING thì trả 503 để Sepay tự gửi lại.
+PAYMENT_WORKERS = int(os.getenv("PAYMENT_WORKERS", "8"))
+PAYMENT_MAX_PENDING = int(os.getenv("PAYMENT_MAX_PENDING", str(PAYMENT_WORKERS * 8)))
+_EXECUTOR = concurrent.futures.ThreadPoolExecutor(
+    max_workers=PAYMENT_WORKERS, thread_name_prefix="payment-webhook"
+)
+_pending_slots = threading.BoundedSemaphore(PAYMENT_MAX_PENDING)
+
+# Một event loop sống suốt process cho mọi lần gửi Telegram từ worker webhook:
+# Bot (và httpx client bên trong) gắn với loop này nên kết nối TLS được dùng lại,
+# thay vì asyncio.run() dựng loop + bắt tay TLS mới cho từng mã đơn.
+NOTIFY_TIMEOUT = 30  # giây
+_notify_loop: asyncio.AbstractEventLoop | None = None
+_loop_lock = threading.Lock()
+
+# Thông báo gia hạn đi qua một hàng đợi trên loop đó: worker webhook chỉ xếp hàng
+# rồi đi tiếp, một consumer gửi lần lượt qua token bucket theo giới hạn 30 tin/giây của bot.
+NOTIFY_RATE = 30.0  # token nạp lại mỗi giây
+NOTIFY_BURST = 30
+_notify_queue: asyncio.Queue | None = None
+_notify_task: asyncio.Task | None = None
+
+_bot_instance: Optional[Bot] = None
 _bot_lock = threading.Lock()
 
 
+class _TokenBucket:
+    def __init__(self, rate: float, capacity: int) -> None:
+        self._rate = rate
+        self._capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+
+    async def acquire(self) -> None:
+        while True:
+            now = time.monotonic()
+            self._tokens = min(self._capacity, self._tokens + (now - self._updated) * self._rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self._rate)
+
+
 def _get_bot() -> Bot:
-    """Instantiate a Telegram Bot lazily so Waitress threads can reuse it."""
+    """
+    Instantiate a Telegram Bot lazily so Waitress threads can reuse it.
+    The bot is initialized once on the shared notification loop, so its HTTP
+    connection stays open across webhooks.
+    """
     global _bot_instance
-    if _bot_instance:
-        return _bot_instance
-    with _bot_lock:
-        if _bot_instance is None:
-            _bot_instance = Bot(load_bot_config().token)
+    if _bot_instance is None:
+        with _bot_lock:
+            if _bot_instance is None:
+                bot = Bot(load_bot_config().token)
+                _run_on_notify_loop(bot.initialize())
+                _bot_instance = bot
     return _bot_instance
 
 
+def _stop_notify_loop() -> None:
+    loop = _notify_loop
+    if loop is None or not loop.is_running():
+        return
+    if _notify_queue is not None:
+        try:
+            _run_on_notify_loop(_notify_queue.join())
+        except Exception as exc:  # pragma: no cover - best effort at exit
+            logger.warning("Dropped pending notifications at exit: %s", exc)
+    if _bot_instance is not None:
+        try:
+            _run_on_notify_loop(_bot_instance.shutdown())
+        except Exception as exc:  # pragma: no cover - best effort at exit
+            logger.warning("Failed shutting down notification bot: %s", exc)
+    loop.call_soon_threadsafe(loop.stop)
+
+
+async def _consume_notifications(notify_queue: asyncio.Queue) -> None:
+    bucket = _TokenBucket(NOTIFY_RATE, NOTIFY_BURST)
+    while True:
+        send = await notify_queue.get()
+        try:
+            await bucket.acquire()
+            await send()
+        except Exception as exc:  # pragma: no cover - defensive logging
+            logger.error("Failed to send queued renewal notification: %s", exc, exc_info=True)
+        finally:
+            notify_queue.task_done()
+
+
+async def _start_notify_consumer() -> asyncio.Queue:
+    global _notify_task
+    notify_queue: asyncio.Queue = asyncio.Queue()
+    _notify_task = asyncio.get_running_loop().create_task(_consume_notifications(notify_queue))
+    return notify_queue
+
+
+def _get_notify_loop() -> asyncio.AbstractEventLoop:
+    """Start the shared notification loop (and its send queue) on a daemon thread the first time it is needed."""
+    global _notify_loop, _notify_queue
+    if _notify_loop is not None:
+        return _notify_loop
+    with _loop_lock:
+        if _notify_loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(
+                target=loop.run_forever, name="payment-notify-loop", daemon=True
+            ).start()
+            _notify_queue = asyncio.run_coroutine_threadsafe(_start_notify_consumer(), loop).result()
+            atexit.register(_stop_notify_loop)
+            _notify_loop = loop
+    return _notify_loop
+
+
+def _run_on_notify_loop(coro) -> None:
+    """Run `coro` on the shared loop and wait for it from the calling worker thread."""
+    future = asyncio.run_coroutine_threadsafe(coro, _get_notify_loop())
+    try:
+        future.result(timeout=NOTIFY_TIMEOUT)
+    except concurrent.futures.TimeoutError:
+        future.cancel()
+        raise
+
+
 def extract_ma_don(text: str | None) -> list[str]:
-    """Return all MAV*** order codes found inside a free-text content string."""
+    """Return all MAV*** order codes found inside a free-text content string, in order of appearance."""
     if not text:
         return []
-    return sorted({match.upper() for match in re.findall(r"MAV\w{5,}", text)})
+    return list(dict.fromkeys(match.group(0).upper() for match in _MA_DON_RE.finditer(text)))
 
 
 def _get_payload_value(data: Mapping[str, object], *keys: str) -> object | None:
@@ -91,15 +209,15 @@ def _normalize_amount(value) -> int:
         if not text:
             return 0
         # Remove non-numeric chars except decimal separators, then drop fractional part
-        cleaned = re.sub(r"[^\d.,-]", "", text)
+        cleaned = _AMOUNT_CHARS_RE.sub("", text)
         # Normalize to dot and split
         cleaned = cleaned.replace(",", ".")
         if "." in cleaned:
             cleaned = cleaned.split(".", 1)[0]
-        digits = re.sub(r"[^\d-]", "", cleaned)
+        digits = _SIGNED_DIGITS_RE.sub("", cleaned)
         return int(digits) if digits not in ("", "-", "--") else 0
     except Exception:
-        digits = re.sub(r"[^\d]", "", str(value or ""))
+        digits = _DIGITS_RE.sub("", str(value or ""))
         return int(digits) if digits.isdigit() else 0
 
 
@@ -139,15 +257,25 @@ def _days_left(het_han) -> int:
     return (expiry - date.today()).days
 
 
-def _fetch_order_state(order_code: str) -> Optional[tuple[str, object, object, int]]:
-    sql = f"""
-        SELECT {OrderListColumns.TINH_TRANG}, {OrderListColumns.CHECK_FLAG}, {OrderListColumns.HET_HAN}, {OrderListColumns.ID}
-        FROM {ORDER_LIST_TABLE}
-        WHERE LOWER({OrderListColumns.ID_DON_HANG}) = LOWER(%s)
-        LIMIT 1
-    """
-    row = db.fetch_one(sql, (order_code,))
-    return row if row else None
+_ORDER_STATES_SQL = f"""
+    SELECT
+        LOWER({OrderListColumns.ID_DON_HANG}),
+        {OrderListColumns.TINH_TRANG},
+        {OrderListColumns.CHECK_FLAG},
+        {OrderListColumns.HET_HAN},
+        {OrderListColumns.ID}
+    FROM {ORDER_LIST_TABLE}
+    WHERE LOWER({OrderListColumns.ID_DON_HANG}) = ANY(%s)
+"""
+
+
+def _fetch_order_states(order_codes: list[str]) -> dict[str, tuple[str, object, object, int]]:
+    """Trạng thái của mọi mã đơn trong webhook bằng một câu SELECT, khóa theo mã viết thường."""
+    rows = db.fetch_all(_ORDER_STATES_SQL, ([code.lower() for code in order_codes],))
+    states: dict[str, tuple[str, object, object, int]] = {}
+    for code, trang_thai, check_flag, het_han, order_db_id in rows:
+        states.setdefault(code, (trang_thai, check_flag, het_han, order_db_id))
+    return states
 
 
 def _is_renewal_candidate(trang_thai: str | None, check_flag: object, het_han: object) -> bool:
@@ -166,122 +294,98 @@ def _is_payment_candidate(trang_thai: str | None, check_flag: object) -> bool:
     return check_flag in (None, "", "null")
 
 
-def _mark_order_paid(order_db_id: int) -> None:
-    """
-    For new payments we only flip check_flag from NULL to FALSE and keep tinh_trang unchanged.
-    """
-    sql = f"""
+# Đánh dấu đã thanh toán và tra tiền nhập trong cùng một lượt: CTE UPDATE chỉ lật
+# check_flag NULL -> FALSE (giữ nguyên tinh_trang); phần SELECT đi order -> supply
+# (khớp source_name, bỏ @ đầu) -> product_price -> supply_price mới nhất.
+_MARK_PAID_AND_IMPORT_SQL = f"""
+    WITH upd AS (
         UPDATE {ORDER_LIST_TABLE}
         SET {OrderListColumns.CHECK_FLAG} = FALSE
-        WHERE {OrderListColumns.ID} = %s
+        WHERE {OrderListColumns.ID} = %(order_id)s
           AND {OrderListColumns.CHECK_FLAG} IS NULL
-    """
-    db.execute(sql, (order_db_id,))
-
-
-def _fetch_order_by_code(order_code: str) -> Optional[Mapping[str, object]]:
-    sql = f"""
-        SELECT
-            {OrderListColumns.SAN_PHAM},
-            {OrderListColumns.NGUON},
-            {OrderListColumns.GIA_NHAP}
-        FROM {ORDER_LIST_TABLE}
-        WHERE LOWER({OrderListColumns.ID_DON_HANG}) = LOWER(%s)
-        LIMIT 1
-    """
-    row = db.fetch_one(sql, (order_code,))
-    if not row:
-        return None
-    san_pham, nguon, gia_nhap = row
-    return {
-        "san_pham": san_pham or "",
-        "nguon": nguon or "",
-        "gia_nhap": _normalize_amount(gia_nhap),
-    }
-
-
-def _find_source_id_by_name(name: str | None) -> Optional[int]:
-    """Find supply.id by source_name, matching case-insensitive and allowing leading @ optional."""
-    if not name:
-        return None
-    original = _normalize_source_name(name)
-    stripped = original.lstrip("@")
-    sql = f"""
-        SELECT {SupplyColumns.ID}, {SupplyColumns.SOURCE_NAME}
+    )
+    SELECT s.{SupplyColumns.ID}, sp.{SupplyPriceColumns.PRICE}, o.{OrderListColumns.GIA_NHAP}
+    FROM {ORDER_LIST_TABLE} AS o
+    LEFT JOIN LATERAL (
+        SELECT {SupplyColumns.ID}
         FROM {SUPPLY_TABLE}
-        WHERE LOWER(TRIM({SupplyColumns.SOURCE_NAME})) IN (%s, %s)
+        WHERE LOWER(TRIM({SupplyColumns.SOURCE_NAME})) IN (
+            LOWER(NULLIF(TRIM(o.{OrderListColumns.NGUON}), '')),
+            LTRIM(LOWER(NULLIF(TRIM(o.{OrderListColumns.NGUON}), '')), '@')
+        )
         LIMIT 1
-    """
-    row = db.fetch_one(sql, (original, stripped))
-    return int(row[0]) if row and row[0] is not None else None
-
-
-def _find_product_id_by_name(san_pham: str | None) -> Optional[int]:
-    if not san_pham:
-        return None
-    sql = f"""
+    ) AS s ON TRUE
+    LEFT JOIN LATERAL (
         SELECT {ProductPriceColumns.ID}
         FROM {PRODUCT_PRICE_TABLE}
-        WHERE LOWER({ProductPriceColumns.SAN_PHAM}) = LOWER(%s)
+        WHERE LOWER({ProductPriceColumns.SAN_PHAM}) = LOWER(NULLIF(o.{OrderListColumns.SAN_PHAM}, ''))
         LIMIT 1
-    """
-    row = db.fetch_one(sql, (san_pham,))
-    return int(row[0]) if row and row[0] is not None else None
-
-
-def _resolve_import_from_order(order_code: str) -> Tuple[Optional[int], Optional[int]]:
-    """
-    From an order code, determine source_id and import amount:
-    - source_id from order.nguon -> supply.id
-    - product_id from order.san_pham -> product_price.id
-    - import from supply_price.price for (source_id, product_id)
-    - fallback to order.gia_nhap when no supply_price.
-    """
-    order = _fetch_order_by_code(order_code)
-    if not order:
-        return None, None
-
-    source_id = _find_source_id_by_name(order.get("nguon"))
-    product_id = _find_product_id_by_name(order.get("san_pham"))
-
-    amount = None
-    if source_id and product_id:
-        amount = _fetch_supply_price(source_id, product_id)
-    if amount is None or amount <= 0:
-        amount = order.get("gia_nhap") or 0
-
-    amount_int = _normalize_amount(amount)
-    return source_id, amount_int if amount_int > 0 else None
-
-
-def _fetch_supply_price(source_id: int, product_id: int) -> Optional[int]:
-    """Fetch the latest supply_price for the given source/product pair."""
-    sql = f"""
+    ) AS pp ON TRUE
+    LEFT JOIN LATERAL (
         SELECT {SupplyPriceColumns.PRICE}
         FROM {SUPPLY_PRICE_TABLE}
-        WHERE {SupplyPriceColumns.SOURCE_ID} = %s
-          AND {SupplyPriceColumns.PRODUCT_ID} = %s
+        WHERE {SupplyPriceColumns.SOURCE_ID} = s.{SupplyColumns.ID}
+          AND {SupplyPriceColumns.PRODUCT_ID} = pp.{ProductPriceColumns.ID}
         ORDER BY {SupplyPriceColumns.ID} DESC
         LIMIT 1
+    ) AS sp ON TRUE
+    WHERE o.{OrderListColumns.ID} = %(order_id)s
+"""
+
+
+def _mark_paid_and_resolve_import(order_db_id: int) -> Tuple[Optional[int], Optional[int]]:
     """
-    row = db.fetch_one(sql, (source_id, product_id))
-    if row and row[0] is not None:
-        return _normalize_amount(row[0])
-    return None
+    Flip check_flag NULL -> FALSE for a newly paid order and, in the same round trip,
+    determine its source_id and import amount (latest supply_price, falling back
+    to order.gia_nhap).
+    """
+    rows = db.execute_returning(_MARK_PAID_AND_IMPORT_SQL, {"order_id": order_db_id})
+    if not rows:
+        return None, None
+    source_id, supply_price, gia_nhap = rows[0]
+    amount = _normalize_amount(supply_price) if supply_price is not None else 0
+    if amount <= 0:
+        amount = _normalize_amount(gia_nhap)
+    return (int(source_id) if source_id is not None else None), (amount if amount > 0 else None)
 
 
 def _parse_transaction_date(value: str | None) -> datetime:
     if not value:
         return datetime.utcnow()
-    for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M:%S", "%d/%m/%Y %H:%M:%S"):
-        try:
-            return datetime.strptime(value.strip(), fmt)
-        except ValueError:
-            continue
+    text = str(value).strip()
+    try:
+        # Sepay gửi "YYYY-MM-DD HH:MM:SS" (hoặc dạng có "T"): fromisoformat đọc cả hai.
+        if len(text) >= 10 and text[4] == "-":
+            return datetime.fromisoformat(text)
+        if len(text) >= 10 and text[2] == "/":
+            return datetime.strptime(text, "%d/%m/%Y %H:%M:%S")
+    except ValueError:
+        pass
     return datetime.utcnow()
 
 
-def _insert_payment_receipt(order_codes: Iterable[str], payment_data: Mapping[str, object]) -> None:
+# Biên lai ghi ngay trong worker để biết là lần đầu hay Sepay gửi lại; unique
+# (ma_giao_dich, ma_don_hang) ở migration 005. Payload không có id thì ghi NULL,
+# không vướng ràng buộc nên luôn được tính là biên lai mới.
+_RECEIPT_INSERT_SQL = f"""
+    INSERT INTO {PAYMENT_RECEIPT_TABLE} (
+        {PaymentReceiptColumns.MA_DON_HANG},
+        {PaymentReceiptColumns.NGAY_THANH_TOAN},
+        {PaymentReceiptColumns.SO_TIEN},
+        {PaymentReceiptColumns.NGUOI_GUI},
+        {PaymentReceiptColumns.NOI_DUNG_CK},
+        {PaymentReceiptColumns.MA_GIAO_DICH}
+    ) VALUES (%s, %s, %s, %s, %s, %s)
+    ON CONFLICT ({PaymentReceiptColumns.MA_GIAO_DICH}, {PaymentReceiptColumns.MA_DON_HANG}) DO NOTHING
+    RETURNING {PaymentReceiptColumns.ID}
+"""
+
+
+def _insert_payment_receipt(order_codes: Iterable[str], payment_data: Mapping[str, object]) -> bool:
+    """
+    Log the receipt for this webhook. Returns False when the same Sepay transaction
+    was already recorded (a retried delivery), True otherwise.
+    """
     ma_don_str = " - ".join(order_codes)
     ngay_thanh_toan = _parse_transaction_date(
         _get_payload_value(payment_data, "transactionDate", "transaction_date")
@@ -289,41 +393,46 @@ def _insert_payment_receipt(order_codes: Iterable[str], payment_data: Mapping[st
     so_tien = _normalize_amount(_get_payload_value(payment_data, "transferAmount", "amount_in", "amount"))
     nguoi_gui = str(_get_payload_value(payment_data, "accountNumber", "accountnumber", "fromAccount") or "").strip()
     noi_dung = str(_get_payload_value(payment_data, "content", "transaction_content", "description") or "")
+    transaction_id = str(_get_payload_value(payment_data, "id", "transactionId", "transaction_id") or "").strip()
 
-    sql = f"""
-        INSERT INTO {PAYMENT_RECEIPT_TABLE} (
-            {PaymentReceiptColumns.MA_DON_HANG},
-            {PaymentReceiptColumns.NGAY_THANH_TOAN},
-            {PaymentReceiptColumns.SO_TIEN},
-            {PaymentReceiptColumns.NGUOI_GUI},
-            {PaymentReceiptColumns.NOI_DUNG_CK}
-        ) VALUES (%s, %s, %s, %s, %s)
-    """
-    db.execute(sql, (ma_don_str, ngay_thanh_toan, so_tien, nguoi_gui, noi_dung))
-    logger.info("Logged payment receipt for orders: %s", ma_don_str or "N/A")
+    inserted = db.execute_returning(
+        _RECEIPT_INSERT_SQL,
+        (ma_don_str, ngay_thanh_toan, so_tien, nguoi_gui, noi_dung, transaction_id or None),
+    )
+    if inserted:
+        logger.info("Logged payment receipt for orders: %s", ma_don_str or "N/A")
+    return bool(inserted)
+
+
+def _enqueue_notification(send) -> None:
+    """Queue a zero-argument coroutine function for the notification consumer; returns immediately."""
+    loop = _get_notify_loop()
+    loop.call_soon_threadsafe(_notify_queue.put_nowait, send)
 
 
 def _send_success_notification(order_details: Mapping[str, object]) -> None:
-    """Send the full renewal summary when Sepay renewal succeeds."""
+    """Queue the full renewal summary when Sepay renewal succeeds."""
     try:
-        asyncio.run(send_renewal_success_notification(_get_bot(), order_details))
+        bot = _get_bot()
+        _enqueue_notification(lambda: send_renewal_success_notification(bot, order_details))
     except Exception as exc:  # pragma: no cover - defensive logging
-        logger.error("Failed to send renewal success notification: %s", exc, exc_info=True)
+        logger.error("Failed to queue renewal success notification: %s", exc, exc_info=True)
 
 
 def _send_status_notification(order_code: str, status: str, detail_text: str | None = None) -> None:
-    """Send a lightweight status entry (success/skip/error) to the renewal topic."""
+    """Queue a lightweight status entry (success/skip/error) for the renewal topic."""
     try:
-        asyncio.run(
-            send_renewal_status_notification(
-                _get_bot(),
+        bot = _get_bot()
+        _enqueue_notification(
+            lambda: send_renewal_status_notification(
+                bot,
                 order_code,
                 status,
                 details=detail_text,
             )
         )
     except Exception as exc:  # pragma: no cover - defensive logging
-        logger.error("Failed to send renewal status notification: %s", exc, exc_info=True)
+        logger.error("Failed to queue renewal status notification: %s", exc, exc_info=True)
 
 
 def _find_source_from_content(content: str) -> Tuple[int | None, str | None]:
@@ -407,51 +516,64 @@ def process_payment_payload(payment_data: Mapping[str, object]) -> None:
         logger.info("Processing payment webhook for content: %s", content)
 
         try:
-            _insert_payment_receipt(ma_don_list, payment_data)
+            is_new_receipt = _insert_payment_receipt(ma_don_list, payment_data)
         except Exception as exc:
             logger.error("Failed to log payment receipt: %s", exc, exc_info=True)
+            is_new_receipt = True
+
+        if not is_new_receipt:
+            logger.info("Duplicate payment webhook (already recorded); skipping renewals and notifications.")
+            return
 
         if not ma_don_list:
             logger.info("No order code detected, nothing else to do.")
             return
 
         source_totals: dict[int, int] = {}
+        renewal_codes: list[str] = []
+        order_states = _fetch_order_states(ma_don_list)
 
         for ma_don in ma_don_list:
-            order_state = _fetch_order_state(ma_don)
+            order_state = order_states.get(ma_don.lower())
             if not order_state:
                 logger.info("Order %s not found; skipping.", ma_don)
                 continue
 
             trang_thai, check_flag, het_han, order_db_id = order_state
 
-            # Renewal candidate
+            # Renewal candidate: gom lại để gia hạn một lượt sau vòng lặp
             if _is_renewal_candidate(trang_thai, check_flag, het_han):
-                success, details, process_type = run_renewal(ma_don)
-                if success and process_type == "renewal":
-                    logger.info("Renewal succeeded for %s.", ma_don)
-                    if details:
-                        _send_success_notification(details)
-                else:
-                    detail_text = details if isinstance(details, str) else str(details or "")
-                    status_text = process_type or "error"
-                    _send_status_notification(ma_don, status_text, detail_text or None)
+                renewal_codes.append(ma_don)
                 continue
 
             # Payment candidate
             if _is_payment_candidate(trang_thai, check_flag):
-                source_id, amount_value = _resolve_import_from_order(ma_don)
-                if source_id and amount_value and amount_value > 0:
-                    source_totals[source_id] = source_totals.get(source_id, 0) + int(amount_value)
                 try:
-                    _mark_order_paid(order_db_id)
+                    source_id, amount_value = _mark_paid_and_resolve_import(order_db_id)
                     logger.info("Marked order %s paid (status=False, check_flag=True).", ma_don)
                 except Exception as exc:
                     logger.error("Failed to mark order %s paid: %s", ma_don, exc, exc_info=True)
+                    continue
+                if source_id and amount_value and amount_value > 0:
+                    source_totals[source_id] = source_totals.get(source_id, 0) + int(amount_value)
                 continue
 
             logger.info("Order %s is not renewal or payment candidate; skipping.", ma_don)
 
+        # Mọi đơn cần gia hạn đi chung một SELECT (fetch_all) và một lô UPDATE (execute_batch).
+        if renewal_codes:
+            for ma_don, (success, details, process_type) in zip(
+                renewal_codes, run_renewal_bulk(renewal_codes)
+            ):
+                if success and process_type == "renewal":
+                    logger.info("Renewal succeeded for %s.", ma_don)
+                    if details:
+                        _send_success_notification(details)
+                else:
+                    detail_text = details if isinstance(details, str) else str(details or "")
+                    status_text = process_type or "error"
+                    _send_status_notification(ma_don, status_text, detail_text or None)
+
         # Update payment_supply per source after processing all orders
         for sid, total_amount in source_totals.items():
             _sync_payment_supply(sid, total_amount)
@@ -472,11 +594,11 @@ def handle_payment_webhook():
         logger.exception("Invalid JSON payload received from payment provider.")
         return jsonify({"message": "Invalid JSON"}), 400
 
-    threading.Thread(
-        target=process_payment_payload,
-        args=(payload or {},),
-        name="payment-webhook-worker",
-        daemon=True,
-    ).start()
+    if not _pending_slots.acquire(blocking=False):
+        logger.warning("Payment webhook backlog full (%s pending); asking provider to retry.", PAYMENT_MAX_PENDING)
+        return jsonify({"message": "Busy, retry later"}), 503
+
+    future = _EXECUTOR.submit(process_payment_payload, payload or {})
+    future.add_done_callback(lambda _: _pending_slots.release())
 
     return jsonify({"message": "OK"}), 200
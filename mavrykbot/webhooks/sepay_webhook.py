@@ -6,6 +6,7 @@ import hmac
 import json
 import logging
 import os
+import sys
 import threading
 from typing import Any, Dict, Optional
 from urllib.parse import urlparse
@@ -21,7 +22,6 @@ try:
 except ModuleNotFoundError as exc:
     if exc.name not in {"mavrykbot", "mavrykbot.bootstrap"}:
         raise
-    import sys
     from pathlib import Path
     sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
     from mavrykbot.bootstrap import ensure_env_loaded, ensure_project_root
@@ -51,6 +51,11 @@ WEBHOOK_SECRET = os.getenv("TELEGRAM_WEBHOOK_SECRET") or os.getenv("WEBHOOK_SECR
 _parsed_url = urlparse(WEBHOOK_URL) if WEBHOOK_URL else None
 TELEGRAM_WEBHOOK_PATH = (_parsed_url.path or "/webhook") if _parsed_url else "/webhook"
 
+# Bot chỉ đăng ký handler cho tin nhắn/lệnh và callback query; các loại update
+# khác (edited_message, inline_query, chat_member...) Telegram sẽ không gửi tới.
+# Thêm loại update vào đây nếu sau này có handler cần đến.
+TELEGRAM_ALLOWED_UPDATES = [Update.MESSAGE, Update.CALLBACK_QUERY]
+
 try:
     SEPAY_CFG = load_sepay_config()
 except RuntimeError:
@@ -84,6 +89,18 @@ _telegram_available = False
 _telegram_lock = threading.Lock()
 
 
+def _new_event_loop() -> asyncio.AbstractEventLoop:
+    """Dùng uvloop khi có (Linux/macOS); Windows và môi trường dev giữ loop mặc định."""
+    if sys.platform != "win32":
+        try:
+            import uvloop
+        except ImportError:
+            pass
+        else:
+            return uvloop.new_event_loop()
+    return asyncio.new_event_loop()
+
+
 def _start_telegram_bot() -> None:
     """Starts Telegram webhook listener in a background async thread."""
     global _telegram_available
@@ -101,6 +118,7 @@ def _start_telegram_bot() -> None:
                 _telegram_app.bot.set_webhook(
                     url=WEBHOOK_URL,
                     secret_token=WEBHOOK_SECRET,
+                    allowed_updates=TELEGRAM_ALLOWED_UPDATES,
                 )
             )
 
@@ -126,7 +144,7 @@ def _ensure_telegram_initialized() -> None:
             return
 
         _telegram_app = build_application()
-        _telegram_loop = asyncio.new_event_loop()
+        _telegram_loop = _new_event_loop()
 
         threading.Thread(
             target=_start_telegram_bot,
@@ -0,0 +1,8 @@
+-- Index phục vụ hai truy vấn nóng trong add_order:
+--   * chon_ma_sp_handler: WHERE product_id = %s AND price > 0 ORDER BY source_name
+--   * chon_nguon_handler: MAX(price) WHERE product_id = %s
+-- Partial index khớp đúng điều kiện price > 0 nên MAX() có thể quét chỉ trên index.
+-- CONCURRENTLY không chạy được trong transaction: chạy file này bằng psql (autocommit).
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_supply_price_product_price
+    ON mavryk.supply_price (product_id, price)
+    WHERE price > 0;
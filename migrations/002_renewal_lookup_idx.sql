@@ -0,0 +1,12 @@
+-- Index cho truy vấn gộp _RENEWAL_CONTEXT_SQL trong renewal_logic:
+--   * product_price / supply được nối theo LOWER(tên) nên cần functional index
+--   * supply_price được tra theo cặp (product_id, source_id)
+-- CONCURRENTLY không chạy được trong transaction: chạy file này bằng psql (autocommit).
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_product_price_san_pham_lower
+    ON mavryk.product_price (LOWER(san_pham));
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_supply_source_name_lower
+    ON mavryk.supply (LOWER(source_name));
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_supply_price_product_source
+    ON mavryk.supply_price (product_id, source_id);
@@ -0,0 +1,15 @@
+-- Index cho hai truy vấn tìm đơn trong update_order:
+--   * _SQL_ORDER_BY_ID: WHERE LOWER(id_don_hang) = LOWER(%s) -> functional index
+--   * _SQL_ORDER_BY_INFO: thong_tin_san_pham ILIKE '%...%' OR san_pham ILIKE '%...%'
+--     -> trigram GIN cho từng cột để planner gộp bằng BitmapOr thay vì seq scan
+-- CONCURRENTLY không chạy được trong transaction: chạy file này bằng psql (autocommit).
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_order_list_id_don_hang_lower
+    ON mavryk.order_list (LOWER(id_don_hang));
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_order_list_thong_tin_trgm
+    ON mavryk.order_list USING GIN (thong_tin_san_pham gin_trgm_ops);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_order_list_san_pham_trgm
+    ON mavryk.order_list USING GIN (san_pham gin_trgm_ops);
@@ -0,0 +1,8 @@
+-- Partial index cho fetch_due_orders trong view_due_orders:
+--   WHERE LOWER(tinh_trang) = LOWER('Cần Gia Hạn') AND het_han::date - CURRENT_DATE = %s
+--   ORDER BY het_han
+-- Chỉ giữ các đơn "Cần Gia Hạn" nên index nhỏ và đã sắp theo het_han.
+-- CONCURRENTLY không chạy được trong transaction: chạy file này bằng psql (autocommit).
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_order_list_due_het_han
+    ON mavryk.order_list (het_han)
+    WHERE LOWER(tinh_trang) = LOWER('Cần Gia Hạn');
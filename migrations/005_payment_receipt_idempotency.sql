@@ -0,0 +1,8 @@
+-- Chống ghi trùng biên lai khi Sepay gửi lại cùng một webhook (payment_webhook):
+--   INSERT ... ON CONFLICT (ma_giao_dich, ma_don_hang) DO NOTHING RETURNING id
+-- ma_giao_dich là id giao dịch Sepay; các dòng cũ để NULL nên không vướng ràng buộc.
+-- CONCURRENTLY không chạy được trong transaction: chạy file này bằng psql (autocommit).
+ALTER TABLE mavryk.payment_receipt ADD COLUMN IF NOT EXISTS ma_giao_dich text;
+
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS uq_payment_receipt_giao_dich_ma_don
+    ON mavryk.payment_receipt (ma_giao_dich, ma_don_hang);
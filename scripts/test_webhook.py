@@ -1,7 +1,11 @@
-import requests
-import json
+"""
+Script thủ công: gửi payload mẫu tới webhook để kiểm tra.
+Chạy riêng ngoài tiến trình bot: `python scripts/test_webhook.py`.
+"""
 import logging
 
+import requests
+
 # Thiết lập logging
 logging.basicConfig(level=logging.INFO)
 
@@ -18,9 +22,8 @@ payload = {
     "message": "Thanh toán thành công qua VietQR"
 }
 
-# Tiêu đề HTTP (headers)
+# Tiêu đề HTTP bổ sung; Content-Type do requests tự đặt khi dùng json=.
 headers = {
-    "Content-Type": "application/json"
     # Thêm tiêu đề bảo mật nếu webhook yêu cầu (ví dụ: 'X-Signature': '...')
 }
 
@@ -31,7 +34,7 @@ def test_webhook():
     try:
         response = requests.post(
             WEBHOOK_URL, 
-            data=json.dumps(payload), 
+            json=payload,
             headers=headers,
             # Thêm timeout để tránh bị treo
             timeout=10 